@@ -1,14 +1,38 @@
-from flask import Flask, jsonify, request, send_from_directory, send_file, render_template_string
+from flask import Flask, jsonify, request, send_from_directory, send_file, render_template_string, Response, stream_with_context
 from flask_cors import CORS
 import os
+import io
+import json
+import queue
+import base64
+import random
+import select
+import socket
 import time
 import threading
 import traceback
-import psutil
 import gc
-import torch
+import importlib.util
 
-VERSION = "1.7.0"
+from batching import CANCELLED_ERROR, PRIORITY_CLASSES, QUALITY_LEVELS, GenerationCancelled, GenerationRequest, MicroBatcher
+from engine import ContinuousBatchingEngine
+from jobs import JobStore
+from previews import preview_b64
+from result_cache import ResultCache
+from embedding_cache import PromptEmbeddingCache
+from sprite_pool import SpritePool
+from singleflight import SingleFlight
+from latent_cache import InitLatentCache
+from latent_store import LatentStore
+from schedulers import DEFAULT_SCHEDULER, create_scheduler, scheduler_names
+from token_merging import MAX_RATIO as MAX_TOME_RATIO, TokenMerging
+from memory_policy import MemoryPolicy
+from vae_tiling import VaeTiler
+from warmup import Warmup, parse_buckets
+from model_registry import ModelRegistry, ModelUnavailable
+from snapshot import save_snapshot, snapshot_problems
+
+VERSION = "1.32.0"
 
 app = Flask(__name__)
 CORS(app)
@@ -157,6 +181,16 @@ HTML_TEMPLATE = '''
                 </select>
             </div>
             
+            <div class="form-group">
+                <label for="scheduler">Sampler:</label>
+                <select id="scheduler" name="scheduler">
+                    <option value="" selected>Server default</option>
+                    <option value="dpmpp_2m_karras">DPM-Solver++ 2M Karras - Few steps</option>
+                    <option value="euler_a">Euler Ancestral</option>
+                    <option value="unipc">UniPC - Few steps</option>
+                </select>
+            </div>
+            
             <button type="submit" id="generateBtn">🚀 Generate Image</button>
         </form>
         
@@ -171,6 +205,7 @@ HTML_TEMPLATE = '''
             const prompt = document.getElementById('prompt').value;
             const steps = parseInt(document.getElementById('steps').value);
             const size = parseInt(document.getElementById('size').value);
+            const scheduler = document.getElementById('scheduler').value || undefined;
             
             const generateBtn = document.getElementById('generateBtn');
             const status = document.getElementById('status');
@@ -192,6 +227,7 @@ HTML_TEMPLATE = '''
                     body: JSON.stringify({
                         prompt: prompt,
                         steps: steps,
+                        scheduler: scheduler,
                         width: size,
                         height: size
                     })
@@ -229,13 +265,74 @@ class StableDiffusionService:
     def __init__(self):
         self.pipeline = None
         self.img2img_pipeline = None
+        # Tiny distilled autoencoder for quality="preview" decodes, loaded next to the pipeline
+        self.tiny_vae = None
+        self.tiny_vae_id = os.environ.get("SD_TINY_VAE", "madebyollin/taesd")
         self.model_loaded = False
+        self.model_id = None
         self.load_lock = threading.Lock()
-        self.device = self._get_best_device()
-        self.provider = self._get_onnx_provider()
+        # Candidate models and their local snapshots; SD_MODEL pins one of them
+        self.model_registry = ModelRegistry.load(os.environ.get(
+            "SD_MODEL_REGISTRY", os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_registry.json")))
+        self.requested_model = os.environ.get("SD_MODEL") or None
+        self.model_download = os.environ.get("SD_MODEL_DOWNLOAD", "1") != "0"
+        self.model_source = None
+        # Detecting the device imports torch, so it happens on first use rather than at startup
+        self._device = None
+        self.backend = self._get_backend(os.environ.get("SD_BACKEND", "torch"))
+        # Both settle when the model loads, since checking them needs torch / onnxruntime
+        self.provider = None
+        self.quantization = None
+        self.quantize_mode = os.environ.get("SD_QUANTIZE", "none")
+        self.snapshot_mode = os.environ.get("SD_SNAPSHOT", "1") != "0"
+        self.snapshots = False
+        # tomesd patches PyTorch transformer blocks, which the ONNX graphs do not have
+        self.token_merging = TokenMerging(default_ratio=float(os.environ.get("SD_TOME_RATIO", "0")),
+                                          enabled=self.backend == "torch")
+        # Large requests run at full size with sliced attention / sliced or tiled VAE instead of being shrunk
+        self.memory_policy = MemoryPolicy(
+            self._available_memory_gb,
+            attention_mode=os.environ.get("SD_ATTENTION_MODE", "auto"),
+            vae_mode=os.environ.get("SD_VAE_MODE", "auto"),
+            tile_threshold_px=int(os.environ.get("SD_VAE_TILE_THRESHOLD_PX", str(768 * 768))),
+        )
+        self.vae_tiler = VaeTiler(
+            tile_size=int(os.environ.get("SD_VAE_TILE_SIZE", "512")),
+            overlap=int(os.environ.get("SD_VAE_TILE_OVERLAP", "64")),
+        )
+        self.embedding_cache = PromptEmbeddingCache(max_items=int(os.environ.get("SD_EMBED_CACHE_ITEMS", "256")))
+        self.init_latent_cache = InitLatentCache(max_items=int(os.environ.get("SD_INIT_LATENT_CACHE_ITEMS", "32")))
+        # Sampler used when a request does not name one; see schedulers.SCHEDULERS
+        self.default_scheduler = os.environ.get("SD_DEFAULT_SCHEDULER", DEFAULT_SCHEDULER)
+        
+        # Concurrent /generate calls share UNet work, either per step or per whole request
+        self.batcher = self._create_dispatcher(os.environ.get("SD_BATCHING", "continuous"))
         
+    def _create_dispatcher(self, mode):
+        """Build the request dispatcher used by /generate"""
+        max_batch_size = int(os.environ.get("SD_MAX_BATCH_SIZE", "4"))
+        if mode == "micro":
+            return MicroBatcher(
+                self,
+                window_ms=float(os.environ.get("SD_BATCH_WINDOW_MS", "50")),
+                max_batch_size=max_batch_size,
+            )
+        return ContinuousBatchingEngine(self, max_batch_size=max_batch_size)
+
+    @property
+    def device(self):
+        if self._device is None:
+            # Latents and scheduler math stay on the host when the ONNX Runtime provider runs the models
+            self._device = "cpu" if self.backend == "ort" else self._get_best_device()
+        return self._device
+
+    def detected_device(self):
+        """The compute device if it has been detected yet, without importing torch"""
+        return self._device
+
     def _get_best_device(self):
         """Determine the best available device"""
+        import torch
         if torch.cuda.is_available():
             return "cuda"
         elif hasattr(torch.backends, 'mps') and torch.backends.mps.is_available():
@@ -243,14 +340,14 @@ class StableDiffusionService:
         else:
             return "cpu"
             
-    def _get_onnx_provider(self):
-        """Get the best ONNX Runtime provider"""
+    def _get_onnx_provider(self, device):
+        """Get the best ONNX Runtime provider for the best available device"""
         try:
             import onnxruntime as ort
             available_providers = ort.get_available_providers()
             print(f"Available ONNX providers: {available_providers}")
             
-            if self.device == "cuda" and "CUDAExecutionProvider" in available_providers:
+            if device == "cuda" and "CUDAExecutionProvider" in available_providers:
                 return "CUDAExecutionProvider"
             elif "DmlExecutionProvider" in available_providers:
                 # Use DirectML for better performance
@@ -261,8 +358,64 @@ class StableDiffusionService:
         except ImportError:
             return "CPUExecutionProvider"
             
+    def _get_backend(self, backend):
+        """Validate the requested inference backend, falling back to PyTorch when ORT is unavailable"""
+        if backend != "ort":
+            return "torch"
+        # Only checks that it is installed; importing it is left to load_model
+        if importlib.util.find_spec("onnxruntime") is not None:
+            return "ort"
+        print("WARNING: SD_BACKEND=ort but onnxruntime is not installed, using PyTorch")
+        return "torch"
+
+    def _get_quantization(self, mode):
+        """Validate the requested quantization mode; dynamic INT8 only runs on the PyTorch CPU path"""
+        if mode != "int8":
+            return None
+        if self.backend != "torch" or self.device != "cpu":
+            print(f"WARNING: SD_QUANTIZE=int8 needs the PyTorch backend on CPU (backend: {self.backend}, device: {self.device}), ignoring")
+            return None
+        return "int8"
+
+    def _model_cache_dir(self, env_var, name, model_id=None):
+        """Per-model directory for derived artifacts, under env_var or .cache/<name> next to app.py"""
+        base = os.environ.get(env_var, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", name))
+        return os.path.join(base, (model_id or self.model_id).replace("/", "--"))
+
+    def _snapshot_dir(self, entry):
+        """Where the prepared pipeline snapshot for a registry entry on this device lives"""
+        return os.path.join(self._model_cache_dir("SD_SNAPSHOT_DIR", "snapshots", entry.model_id),
+                            entry.dtype_name(self.device))
+
+    def _usable_snapshot(self, entry):
+        """The entry's snapshot directory when it is complete and current, else None"""
+        if not self.snapshots:
+            return None
+        snapshot_dir = self._snapshot_dir(entry)
+        problems = snapshot_problems(snapshot_dir, entry, entry.dtype_name(self.device), self.model_registry.locate(entry))
+        if problems and os.path.exists(snapshot_dir):
+            print(f"[SNAPSHOT] Ignoring {snapshot_dir}: {'; '.join(problems)}")
+        return None if problems else snapshot_dir
+
+    def model_fingerprint(self):
+        """Model id plus anything that changes its numerics, for cache keys"""
+        variant = [part for part in (self.backend if self.backend != "torch" else None, self.quantization) if part]
+        return "+".join([self.model_id or ""] + variant)
+
+    def _available_memory_gb(self):
+        """Memory a generation can still use on the compute device"""
+        import psutil
+        if self.device == "cuda":
+            import torch
+            free, _ = torch.cuda.mem_get_info()
+            # Blocks cached by the allocator but not in use are available to the next call too
+            cached = torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+            return (free + cached) / (1024**3)
+        return psutil.virtual_memory().available / (1024**3)
+
     def get_memory_info(self):
         """Get current memory usage information"""
+        import psutil
         memory = psutil.virtual_memory()
         return {
             "total_gb": round(memory.total / (1024**3), 2),
@@ -272,7 +425,7 @@ class StableDiffusionService:
         }
     
     def load_model(self):
-        """Load Stable Diffusion ONNX model using Hugging Face Optimum"""
+        """Load the Stable Diffusion pipeline, optionally running its models through ONNX Runtime"""
         if self.model_loaded:
             return True
             
@@ -285,47 +438,72 @@ class StableDiffusionService:
                 print(f"Available memory: {self.get_memory_info()['available_gb']:.1f}GB")
                 
                 # Use regular diffusers with a simple, compatible model
+                import torch
                 from diffusers import StableDiffusionPipeline, StableDiffusionImg2ImgPipeline
                 
-                # Try multiple models in order of preference (simplest first)
-                models_to_try = [
-                    "runwayml/stable-diffusion-v1-5",  # Most compatible
-                    "CompVis/stable-diffusion-v1-4",   # Fallback 1  
-                    "hf-internal-testing/tiny-stable-diffusion-torch"  # Fallback 2 (original)
-                ]
+                self.quantization = self._get_quantization(self.quantize_mode)
+                # INT8 modules are cached by quantization.py instead; they cannot be stored as safetensors
+                self.snapshots = self.snapshot_mode and self.quantization is None
+                if self.backend == "ort":
+                    self.provider = self._get_onnx_provider(self._get_best_device())
+                
+                # Resolved from local files only; a missing or incomplete model fails here, not at a Hub timeout
+                try:
+                    entry, folder = self.model_registry.resolve(self.requested_model, prepared=self._usable_snapshot)
+                except ModelUnavailable as unavailable:
+                    if not self.model_download:
+                        raise
+                    print(f"{unavailable}\nSD_MODEL_DOWNLOAD is enabled, fetching it once")
+                    entry, folder = self.model_registry.resolve(self.model_registry.download(self.requested_model))
+                
+                dtype_name = entry.dtype_name(self.device)
+                from_snapshot = self.snapshots and folder == self._snapshot_dir(entry)
+                self.model_source = "snapshot" if from_snapshot else "registry"
+                print(f"Loading model {entry.model_id} ({dtype_name}) from {folder}")
+                load_start = time.time()
+                
+                # Cached quantized modules are passed in, so their float32 weights are never loaded
+                quantized = {}
+                if self.quantization == "int8":
+                    from quantization import load_quantized_components, quantize_pipeline
+                    int8_cache_dir = self._model_cache_dir("SD_INT8_CACHE_DIR", "int8", entry.model_id)
+                    quantized = load_quantized_components(int8_cache_dir)
+                
+                self.pipeline = StableDiffusionPipeline.from_pretrained(
+                    folder,
+                    torch_dtype=getattr(torch, dtype_name),
+                    # Snapshots are always plain target-dtype safetensors
+                    use_safetensors=True if from_snapshot else entry.safetensors,
+                    variant=None if from_snapshot else entry.variant,
+                    local_files_only=True,
+                    safety_checker=None,
+                    requires_safety_checker=False,
+                    **quantized
+                )
+                self.pipeline = self.pipeline.to(self.device)
+                print(f"  Weights loaded in {time.time() - load_start:.1f}s from {self.model_source}")
                 
-                model_loaded = False
-                for model_id in models_to_try:
+                if self.snapshots and not from_snapshot:
                     try:
-                        print(f"Attempting to load model: {model_id}")
-                        
-                        self.pipeline = StableDiffusionPipeline.from_pretrained(
-                            model_id,
-                            torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-                            safety_checker=None,
-                            requires_safety_checker=False,
-                            use_safetensors=True if "runwayml" in model_id or "CompVis" in model_id else False
-                        )
-                        self.pipeline = self.pipeline.to(self.device)
-                        
-                        # Enable memory efficient attention if available
-                        if hasattr(self.pipeline.unet, 'set_attn_slice'):
-                            self.pipeline.unet.set_attn_slice("auto")
-                        
-                        print(f"OK: StableDiffusionPipeline loaded successfully")
-                        print(f"  Model: {model_id}")
-                        print(f"  Device: {self.device}")
-                        print(f"  Memory efficient attention: {hasattr(self.pipeline.unet, 'set_attn_slice')}")
-                        
-                        model_loaded = True
-                        break
-                        
-                    except Exception as model_error:
-                        print(f"Failed to load {model_id}: {model_error}")
-                        continue
+                        save_snapshot(self.pipeline, self._snapshot_dir(entry), entry, dtype_name, folder)
+                    except Exception as e:
+                        print(f"WARNING: Failed to write pipeline snapshot: {e}")
+                
+                if self.quantization == "int8" and not quantized:
+                    quantize_pipeline(self.pipeline, int8_cache_dir)
+                    gc.collect()
                 
-                if not model_loaded:
-                    raise Exception("Failed to load any compatible model")
+                print(f"OK: StableDiffusionPipeline loaded successfully")
+                print(f"  Model: {entry.model_id}")
+                print(f"  Device: {self.device}")
+                
+                self.model_id = entry.model_id
+                
+                if self.backend == "ort":
+                    from ort_backend import use_ort_backend
+                    use_ort_backend(self.pipeline, self._model_cache_dir("SD_ONNX_CACHE_DIR", "onnx"), self.provider,
+                                    threads=int(os.environ.get("SD_ORT_THREADS", "0")))
+                    gc.collect()
                 
                 # Load img2img pipeline using the same components
                 print("Loading img2img pipeline...")
@@ -341,6 +519,16 @@ class StableDiffusionService:
                 )
                 print("OK: Img2img pipeline loaded successfully")
                 
+                self.memory_policy.bind(self.pipeline, self.device)
+                # Tile geometry is in image pixels; the latent tiles follow from the loaded VAE's downsampling
+                self.vae_tiler.scale_factor = self.pipeline.vae_scale_factor
+                self.token_merging.bind(self.pipeline.unet)
+                self._load_tiny_vae()
+                
+                # The unconditional (empty prompt) embedding only depends on the model, encode it once
+                self.embedding_cache.reset(self.pipeline, self.device)
+                self.init_latent_cache.clear()
+                
                 self.model_loaded = True
                 
                 # Force garbage collection after loading
@@ -356,82 +544,148 @@ class StableDiffusionService:
             traceback.print_exc()
             return False
     
-    def _reset_scheduler_state(self):
-        """Reset the scheduler state to prevent PNDM corruption after interrupted generations"""
+    def _load_tiny_vae(self):
+        """Load the preview decoder; without it, preview requests fall back to the full VAE"""
+        if not self.tiny_vae_id:
+            return
         try:
-            if self.pipeline and hasattr(self.pipeline, 'scheduler'):
-                # Reset scheduler's internal state that may be corrupted
-                scheduler = self.pipeline.scheduler
-                if hasattr(scheduler, 'timesteps'):
-                    scheduler.timesteps = None
-                if hasattr(scheduler, '_step_index'):
-                    scheduler._step_index = None
-                if hasattr(scheduler, 'ets'):
-                    scheduler.ets = []
-                if hasattr(scheduler, 'cur_sample'):
-                    scheduler.cur_sample = None
-                print("Scheduler state reset after error")
-        except Exception as reset_error:
-            print(f"Warning: Failed to reset scheduler state: {reset_error}")
-
-    def generate_image(self, prompt, steps=20, width=512, height=512):
-        """Generate image from text prompt with memory management"""
-        if not self.model_loaded:
-            if not self.load_model():
-                return None, "Model failed to load"
-        
-        # Check available memory before generation
+            import torch
+            from diffusers import AutoencoderTiny
+            dtype = torch.float16 if self.device == "cuda" else torch.float32
+            try:
+                # Local files first, like the main model, so a cached decoder never costs a Hub round trip
+                tiny_vae = AutoencoderTiny.from_pretrained(self.tiny_vae_id, torch_dtype=dtype, local_files_only=True)
+            except (OSError, ValueError):
+                if not self.model_download:
+                    raise
+                print(f"Preview decoder {self.tiny_vae_id} is not available locally, downloading it once")
+                tiny_vae = AutoencoderTiny.from_pretrained(self.tiny_vae_id, torch_dtype=dtype)
+            self.tiny_vae = tiny_vae.to(self.device)
+            print(f"OK: Preview decoder loaded: {self.tiny_vae_id}")
+        except Exception as e:
+            self.tiny_vae = None
+            print(f"WARNING: Failed to load preview decoder {self.tiny_vae_id}, previews use the full VAE: {e}")
+
+    def _new_scheduler(self, name=None):
+        """Build a fresh scheduler from the shared config so no denoising state is shared between requests"""
+        return create_scheduler(name or self.default_scheduler, self.pipeline.scheduler)
+
+    def _request_pipeline(self, pipeline, scheduler=None):
+        """Return a view of the pipeline that shares all model weights but owns its scheduler"""
+        # from_pipe casts to float32 by default, which would convert the shared fp16 models in place
+        return pipeline.__class__.from_pipe(pipeline, scheduler=self._new_scheduler(scheduler), torch_dtype=None)
+
+    def _check_memory(self):
+        """Check available memory before generation, returns (memory_info, error)"""
         memory_info = self.get_memory_info()
         if memory_info["available_gb"] < 2.0:  # Require at least 2GB free
             gc.collect()
             if self.device == "cuda":
+                import torch
                 torch.cuda.empty_cache()
             memory_info = self.get_memory_info()
             if memory_info["available_gb"] < 1.5:  # Still not enough after cleanup
-                return None, f"Insufficient memory: {memory_info['available_gb']:.1f}GB available, need at least 1.5GB"
+                return memory_info, f"Insufficient memory: {memory_info['available_gb']:.1f}GB available, need at least 1.5GB"
+        return memory_info, None
+
+    def generate_image(self, prompt, steps=20, width=512, height=512, seed=None, scheduler=None, tome_ratio=None,
+                       quality="full"):
+        """Generate image from text prompt with memory management"""
+        images, error = self.generate_batch([prompt], steps, width, height, seeds=[seed], scheduler=scheduler,
+                                            tome_ratio=tome_ratio, quality=quality)
+        if error:
+            return None, error
+        return images[0], None
+
+    def generate_batch(self, prompts, steps=20, width=512, height=512, step_callback=None, seeds=None, scheduler=None,
+                       tome_ratio=None, quality="full"):
+        """Generate one image per prompt in a single pipeline call
+        
+        step_callback, if given, is called as step_callback(step, total_steps, latents) after every denoising step.
+        seeds, if given, holds one seed (or None) per prompt for reproducible output.
+        scheduler names the sampler to use (see schedulers.SCHEDULERS); None means the server default.
+        tome_ratio is the fraction of tokens merged in UNet self-attention; None means the server default.
+        quality "preview" decodes with the tiny autoencoder instead of the full VAE.
+        """
+        latents, error = self.generate_batch_latents(prompts, steps, width, height, step_callback, seeds, scheduler,
+                                                     tome_ratio)
+        if error:
+            return None, error
+        return self._decode_or_error(latents, quality)
+
+    def _decode_or_error(self, latents, quality="full"):
+        """Decode final latents, returns (images, error)"""
+        try:
+            images = self.decode_latents(latents, quality)
+            gc.collect()
+            if self.device == "cuda":
+                import torch
+                torch.cuda.empty_cache()
+            return images, None
+        except Exception as e:
+            print(f"VAE decode failed: {e}")
+            traceback.print_exc()
+            return None, f"Decode error: {e}"
+
+    def generate_batch_latents(self, prompts, steps=20, width=512, height=512, step_callback=None, seeds=None,
+                               scheduler=None, tome_ratio=None):
+        """Run the txt2img denoising loop for a batch of prompts, returns (latents, error) without decoding"""
+        import torch
+        if not self.model_loaded:
+            if not self.load_model():
+                return None, "Model failed to load"
+        
+        memory_info, memory_error = self._check_memory()
+        if memory_error:
+            return None, memory_error
         
         try:
-            print(f"Generating image for: {prompt}")
-            print(f"Settings: {steps} steps, {width}x{height}, device: {self.device}")
+            print(f"Generating {len(prompts)} image(s) for: {prompts}")
+            print(f"Settings: {steps} steps, {width}x{height}, scheduler: {scheduler or self.default_scheduler}, device: {self.device}")
             print(f"Memory before generation: {memory_info['available_gb']:.1f}GB available")
             
-            # Reduce dimensions if memory is tight
-            if memory_info["available_gb"] < 4.0:
-                width = min(width, 256)
-                height = min(height, 256)
-                steps = min(steps, 10)
-                print(f"Reduced settings due to memory: {steps} steps, {width}x{height}")
-            
+            prompt_embeds, negative_prompt_embeds = self.embedding_cache.encode_batch(prompts)
             generation_kwargs = {
-                "prompt": prompt,
+                "prompt_embeds": prompt_embeds,
+                "negative_prompt_embeds": negative_prompt_embeds,
                 "num_inference_steps": steps,
                 "guidance_scale": 7.5,
                 "width": width,
-                "height": height
+                "height": height,
+                "output_type": "latent"
             }
             
-            # Memory efficient attention is already enabled in load_model()
-            # No need to set it again here as it persists
+            if seeds and any(seed is not None for seed in seeds):
+                # diffusers needs a generator for every prompt once any of them is seeded
+                generation_kwargs["generator"] = [
+                    torch.Generator(device=self.device).manual_seed(seed if seed is not None else random.randrange(2**32))
+                    for seed in seeds
+                ]
+            
+            if step_callback:
+                def on_step_end(pipe, step_index, timestep, callback_kwargs):
+                    step_callback(step_index + 1, pipe.num_timesteps, callback_kwargs["latents"])
+                    return callback_kwargs
+                generation_kwargs["callback_on_step_end"] = on_step_end
             
-            image = self.pipeline(**generation_kwargs).images[0]
+            # A private scheduler per call keeps concurrent and interrupted runs from corrupting each other
+            # Latents come back undecoded so callers can keep them (latent handles) before decode_latents
+            plan = self.memory_policy.plan(width, height, len(prompts))
+            with self.token_merging.use(tome_ratio), self.memory_policy.use(plan):
+                latents = self._request_pipeline(self.pipeline, scheduler)(**generation_kwargs).images
+            return latents, None
             
-            # Clean up after generation
+        except GenerationCancelled:
+            # Every request in this call was cancelled; the private scheduler is simply discarded
+            print("Generation cancelled at step boundary")
             gc.collect()
-            if self.device == "cuda":
-                torch.cuda.empty_cache()
-                
-            return image, None
+            return None, CANCELLED_ERROR
             
         except Exception as e:
             error_msg = str(e)
             print(f"Generation failed: {error_msg}")
             traceback.print_exc()
             
-            # Reset scheduler state if corruption detected (PNDM list index error)
-            if "list index out of range" in error_msg and "scheduling" in error_msg.lower():
-                print("⚠️ Detected PNDM scheduler corruption - resetting scheduler state")
-                self._reset_scheduler_state()
-            
             # Clean up on error
             gc.collect()
             if self.device == "cuda":
@@ -442,68 +696,62 @@ class StableDiffusionService:
                 return None, f"Out of memory error. Try reducing image size or inference steps. Available: {self.get_memory_info()['available_gb']:.1f}GB"
             elif "cuda" in error_msg.lower():
                 return None, f"CUDA error: {error_msg}"
-            elif "list index out of range" in error_msg and "scheduling" in error_msg.lower():
-                return None, f"Scheduler corruption detected and reset. Please try again. Error: {error_msg}"
             else:
                 return None, f"Generation error: {error_msg}"
 
-    def img2img_generate(self, prompt, init_image, strength=0.75, steps=20, width=512, height=512):
+    def img2img_generate(self, prompt, init_image, strength=0.75, steps=20, width=512, height=512, scheduler=None,
+                         tome_ratio=None):
         """Generate image from text prompt and initial image with memory management"""
+        latents, error = self.img2img_latents(prompt, init_image, strength, steps, width, height, scheduler=scheduler,
+                                              tome_ratio=tome_ratio)
+        if error:
+            return None, error
+        images, error = self._decode_or_error(latents)
+        if error:
+            return None, error
+        return images[0], None
+
+    def img2img_latents(self, prompt, init_image=None, strength=0.75, steps=20, width=512, height=512, init_latents=None,
+                        scheduler=None, tome_ratio=None):
+        """Run img2img from an image or from already-encoded init latents, returns (latents, error) without decoding"""
+        import torch
         if not self.model_loaded:
             if not self.load_model():
                 return None, "Model failed to load"
         
-        # Check available memory before generation
-        memory_info = self.get_memory_info()
-        if memory_info["available_gb"] < 2.0:  # Require at least 2GB free
-            gc.collect()
-            if self.device == "cuda":
-                torch.cuda.empty_cache()
-            memory_info = self.get_memory_info()
-            if memory_info["available_gb"] < 1.5:  # Still not enough after cleanup
-                return None, f"Insufficient memory: {memory_info['available_gb']:.1f}GB available, need at least 1.5GB"
+        memory_info, memory_error = self._check_memory()
+        if memory_error:
+            return None, memory_error
         
         try:
             print(f"Generating img2img for: {prompt}")
             print(f"Settings: {steps} steps, {width}x{height}, strength: {strength}, device: {self.device}")
             print(f"Memory before generation: {memory_info['available_gb']:.1f}GB available")
             
-            # Reduce dimensions if memory is tight
-            if memory_info["available_gb"] < 4.0:
-                width = min(width, 256)
-                height = min(height, 256)
-                steps = min(steps, 10)
-                print(f"Reduced settings due to memory: {steps} steps, {width}x{height}")
-            
-            # Resize input image to match target dimensions
-            from PIL import Image
-            if isinstance(init_image, str):
-                init_image = Image.open(init_image)
-            init_image = init_image.resize((width, height))
+            if init_latents is None:
+                # Resized + VAE-encoded once per source image and resolution; the pipeline takes latents directly
+                init_latents = self._init_latents(init_image, width, height)
             
+            prompt_embeds, negative_prompt_embeds = self.embedding_cache.encode_batch([prompt])
             generation_kwargs = {
-                "prompt": prompt,
-                "image": init_image,
+                "prompt_embeds": prompt_embeds,
+                "negative_prompt_embeds": negative_prompt_embeds,
+                "image": init_latents,
                 "strength": strength,
                 "num_inference_steps": steps,
                 "width": width,
                 "height": height,
+                "output_type": "latent",
                 "generator": torch.Generator(device=self.device).manual_seed(42)
             }
             
-            # Generate the image
-            with torch.inference_mode():
-                result = self.img2img_pipeline(**generation_kwargs)
+            # Generate the latents; decoding is left to the caller
+            plan = self.memory_policy.plan(width, height, 1)
+            with torch.inference_mode(), self.token_merging.use(tome_ratio), self.memory_policy.use(plan):
+                result = self._request_pipeline(self.img2img_pipeline, scheduler)(**generation_kwargs)
                 
-                if hasattr(result, 'images') and result.images:
-                    image = result.images[0]
-                    
-                    # Force cleanup after generation
-                    gc.collect()
-                    if self.device == "cuda":
-                        torch.cuda.empty_cache()
-                    
-                    return image, None
+                if hasattr(result, 'images') and len(result.images):
+                    return result.images, None
                 else:
                     return None, "No image generated"
                     
@@ -525,7 +773,189 @@ class StableDiffusionService:
             else:
                 return None, f"Img2img generation error: {error_msg}"
 
+    def _init_latents(self, init_image, width, height):
+        """VAE-encode (or fetch cached) img2img init latents, tiling large images per the memory policy"""
+        from PIL import Image
+        if isinstance(init_image, str):
+            init_image = Image.open(init_image)
+        tiler = self.vae_tiler if self.memory_policy.plan(width, height, 1).vae_tiling else None
+        return self.init_latent_cache.get_or_encode(self.img2img_pipeline, init_image, width, height, tiler=tiler)
+
+    def decode_latents(self, latents, quality="full"):
+        """Decode a batch of scaled latents to PIL images with the pipeline's VAE, per the memory policy
+        
+        quality "preview" uses the tiny autoencoder when it is loaded: a fraction of the VAE's cost, slightly softer output.
+        """
+        import torch
+        if quality == "preview" and self.tiny_vae is not None:
+            with torch.inference_mode():
+                # TAESD is trained on the scaled latents directly (its scaling_factor is 1.0)
+                decoded = self.tiny_vae.decode(latents.to(self.tiny_vae.device, self.tiny_vae.dtype), return_dict=False)[0]
+                return self.pipeline.image_processor.postprocess(decoded, output_type="pil")
+        
+        vae = self.pipeline.vae
+        height, width = (size * self.pipeline.vae_scale_factor for size in latents.shape[-2:])
+        plan = self.memory_policy.plan(width, height, latents.shape[0])
+        with torch.inference_mode():
+            latents = latents / vae.config.scaling_factor
+            if plan.vae_tiling:
+                decoded = torch.cat([self.vae_tiler.decode(vae, chunk) for chunk in latents.split(1)])
+            elif plan.vae_slicing:
+                decoded = torch.cat([vae.decode(chunk, return_dict=False)[0] for chunk in latents.split(1)])
+            else:
+                decoded = vae.decode(latents, return_dict=False)[0]
+            return self.pipeline.image_processor.postprocess(decoded, output_type="pil")
+
+    def img2img_sweep(self, init_image, variations, steps=20, width=512, height=512, seed=42, init_latents=None,
+                      scheduler=None, tome_ratio=None):
+        """Run (strength, prompt) img2img variations of one image (or its init latents) as a single batched denoising job"""
+        import torch
+        from sweep import run_strength_sweep
+        if not self.model_loaded:
+            if not self.load_model():
+                return None, "Model failed to load"
+        if not variations:
+            return [], None
+        
+        memory_info, memory_error = self._check_memory()
+        if memory_error:
+            return None, memory_error
+        
+        try:
+            print(f"Generating img2img sweep of {len(variations)} variation(s)")
+            print(f"Settings: {steps} steps, {width}x{height}, strengths: {[v[0] for v in variations]}, device: {self.device}")
+            
+            if init_latents is None:
+                # Encoded once and shared by every variation
+                init_latents = self._init_latents(init_image, width, height)
+            
+            strengths = [strength for strength, _ in variations]
+            prompt_embeds, negative_prompt_embeds = self.embedding_cache.encode_batch([prompt for _, prompt in variations])
+            
+            plan = self.memory_policy.plan(width, height, len(variations))
+            with torch.inference_mode(), self.token_merging.use(tome_ratio), self.memory_policy.use(plan):
+                latents = run_strength_sweep(
+                    self, init_latents, prompt_embeds, negative_prompt_embeds, strengths, steps,
+                    generator=torch.Generator(device=self.device).manual_seed(seed), scheduler=scheduler
+                )
+            images = self.decode_latents(torch.cat(latents))
+            
+            gc.collect()
+            if self.device == "cuda":
+                torch.cuda.empty_cache()
+            
+            return images, None
+            
+        except Exception as e:
+            error_msg = str(e)
+            print(f"Img2img sweep failed: {error_msg}")
+            traceback.print_exc()
+            
+            gc.collect()
+            if self.device == "cuda":
+                torch.cuda.empty_cache()
+            
+            if "memory" in error_msg.lower() or "allocation" in error_msg.lower():
+                return None, f"Out of memory error. Try fewer variations, a smaller image or fewer steps. Available: {self.get_memory_info()['available_gb']:.1f}GB"
+            elif "cuda" in error_msg.lower():
+                return None, f"CUDA error: {error_msg}"
+            else:
+                return None, f"Img2img sweep error: {error_msg}"
+
 sd_service = StableDiffusionService()
+PREVIEW_EVERY = int(os.environ.get("SD_PREVIEW_EVERY", "2"))
+# Requests without a seed use this one so repeated prompts are deterministic and cacheable; "random" disables it
+DEFAULT_SEED = os.environ.get("SD_DEFAULT_SEED", "0")
+result_cache = ResultCache(
+    memory_items=int(os.environ.get("SD_RESULT_CACHE_ITEMS", "128")),
+    disk_dir=os.environ.get("SD_RESULT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "results")),
+    disk_size_mb=float(os.environ.get("SD_RESULT_CACHE_DISK_MB", "512")),
+)
+
+sprite_pool = SpritePool(
+    sd_service, sd_service.batcher,
+    size_per_prompt=int(os.environ.get("SD_POOL_SIZE", "3")),
+)
+if os.environ.get("SD_POOL_CONFIG"):
+    sprite_pool.load_config(os.environ["SD_POOL_CONFIG"], sd_service.default_scheduler,
+                            sd_service.token_merging.default_ratio)
+
+single_flight = SingleFlight(sd_service.batcher)
+latent_store = LatentStore(
+    max_items=int(os.environ.get("SD_LATENT_HANDLES", "64")),
+    ttl=float(os.environ.get("SD_LATENT_HANDLE_TTL_S", "300")),
+)
+
+def generation_cache_key(params):
+    return ResultCache.make_key(
+        params["prompt"], params["steps"], params["width"], params["height"], params["seed"],
+        params["scheduler"], sd_service.model_fingerprint(), tome_ratio=params["tome_ratio"],
+        quality=params["quality"]
+    )
+
+def finished_generation(params, image, cache_status):
+    """A request object for a result that needs no pipeline work"""
+    generation = GenerationRequest(params["prompt"], params["steps"], params["width"], params["height"],
+                                   priority=params["priority"], seed=params["seed"], scheduler=params["scheduler"],
+                                   tome_ratio=params["tome_ratio"], quality=params["quality"])
+    generation.cache_status = cache_status
+    generation.started_at = generation.submitted_at
+    generation.finish(image)
+    return generation
+
+def enqueue_generation(params, on_step=None):
+    """Serve a generation from the sprite pool, result cache or an identical in-flight run, or queue a new one
+    
+    Fills in params["seed"] when the client did not pin one. Pooled and cached results are
+    images only, so a request asking for a latent handle always goes to the pipeline.
+    """
+    reuse = not params.get("keep_latents")
+    if params["seed"] is None and reuse:
+        pooled = sprite_pool.take(params["prompt"], params["steps"], params["width"], params["height"],
+                                  params["scheduler"], params["tome_ratio"])
+        if pooled is not None:
+            image, params["seed"] = pooled
+            return finished_generation(params, image, "pool")
+    if params["seed"] is None:
+        params["seed"] = int(DEFAULT_SEED) if DEFAULT_SEED != "random" else random.randrange(2**32)
+    
+    key = generation_cache_key(params)
+    if sd_service.model_loaded and reuse:
+        image = result_cache.get(key)
+        if image is not None:
+            return finished_generation(params, image, "hit")
+    
+    def start():
+        generation = sd_service.batcher.enqueue(
+            params["prompt"], params["steps"], params["width"], params["height"],
+            priority=params["priority"], seed=params["seed"], scheduler=params["scheduler"],
+            tome_ratio=params["tome_ratio"], quality=params["quality"]
+        )
+        
+        def store_result(finished):
+            if finished.image is not None:
+                result_cache.put(generation_cache_key(params), finished.image)
+        generation.add_done_callback(store_result)
+        return generation
+    
+    # Identical requests already in flight share that computation instead of starting their own
+    return single_flight.attach(key, start, priority=params["priority"], on_step=on_step)
+
+job_store = JobStore(
+    sd_service.batcher,
+    enqueue_generation,
+    max_jobs=int(os.environ.get("SD_JOB_MAX", "256")),
+    result_ttl=float(os.environ.get("SD_JOB_TTL_S", "600")),
+)
+
+# Started from __main__, so importing this module (benchmarks, tools) does not load the model
+warmup = None
+if os.environ.get("SD_WARMUP", "1") != "0":
+    warmup = Warmup(
+        sd_service, sd_service.batcher,
+        buckets=parse_buckets(os.environ.get("SD_WARMUP_BUCKETS", "512x512")),
+        steps=int(os.environ.get("SD_WARMUP_STEPS", "2")),
+    )
 
 @app.route('/')
 def index():
@@ -534,11 +964,13 @@ def index():
 
 @app.route('/health')
 def health():
+    """Liveness: answers right away, without waiting for torch to import or the model to load"""
     memory_info = sd_service.get_memory_info()
     gpu_info = {}
     
-    # Add GPU information if available
-    if sd_service.device == "cuda" and torch.cuda.is_available():
+    # Add GPU information if available; torch is already imported once the device has been detected
+    if sd_service.detected_device() == "cuda":
+        import torch
         gpu_info = {
             "gpu_available": True,
             "gpu_name": torch.cuda.get_device_name(0),
@@ -554,12 +986,159 @@ def health():
         "timestamp": time.time(),
         "service": "ai-art-service",
         "model_loaded": sd_service.model_loaded,
-        "device": sd_service.device,
-        "onnx_provider": sd_service.provider,
+        "model": sd_service.model_id,
+        "model_source": sd_service.model_source,
+        "registered_models": sd_service.model_registry.model_ids(),
+        "device": sd_service.detected_device(),
+        "backend": sd_service.backend,
+        "quantization": sd_service.quantization,
+        "onnx_provider": sd_service.provider if sd_service.backend == "ort" else None,
+        "default_scheduler": sd_service.default_scheduler,
+        "schedulers": scheduler_names(),
         "memory": memory_info,
+        "result_cache": result_cache.stats(),
+        "embedding_cache": sd_service.embedding_cache.stats(),
+        "sprite_pool": sprite_pool.stats(),
+        "single_flight": single_flight.stats(),
+        "init_latent_cache": sd_service.init_latent_cache.stats(),
+        "latent_handles": latent_store.stats(),
+        "token_merging": sd_service.token_merging.stats(),
+        "memory_policy": sd_service.memory_policy.stats(),
+        "preview_decoder": sd_service.tiny_vae_id if sd_service.tiny_vae is not None else None,
+        "warmup": warmup.status() if warmup is not None else None,
         **gpu_info
     })
 
+@app.route('/ready')
+def ready():
+    """Readiness, separate from /health: 200 only once the model is loaded and warmed up"""
+    if warmup is not None and warmup.worker is not None:
+        is_ready = warmup.is_ready()
+        status = warmup.status()
+    else:
+        # Warm-up disabled: the model loads on the first request, so there is nothing to wait for
+        # and clients polling for 200 would otherwise never send that request
+        is_ready = True
+        status = {"state": "ready" if sd_service.model_loaded else "lazy"}
+    return jsonify({"ready": is_ready, "version": VERSION, **status}), 200 if is_ready else 503
+
+def image_to_b64(image):
+    """Convert PIL image to base64 PNG"""
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode()
+
+def client_disconnected():
+    """Best-effort check whether the HTTP client of the current request has gone away"""
+    sock = request.environ.get("werkzeug.socket")
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        # A readable socket with nothing to read means the peer closed the connection
+        return sock.recv(1, socket.MSG_PEEK) == b""
+    except (OSError, ValueError):
+        return True
+
+def wait_for_generation(generation, poll_interval=0.5):
+    """Wait for a queued generation, cancelling it if the client disconnects first"""
+    while not generation.done.wait(poll_interval):
+        if client_disconnected():
+            print(f"[CANCELLED] Client disconnected, cancelling '{generation.prompt}'")
+            sd_service.batcher.cancel(generation)
+            break
+    generation.done.wait()
+    return generation.image, generation.error
+
+def parse_scheduler(data):
+    """Resolve the requested sampler name, returns (name, error)"""
+    scheduler = data.get('scheduler') or sd_service.default_scheduler
+    if scheduler not in scheduler_names():
+        return None, f"Unknown scheduler '{scheduler}', expected one of {', '.join(scheduler_names())}"
+    return scheduler, None
+
+def parse_tome_ratio(data):
+    """Resolve the requested token merging ratio, returns (ratio, error)"""
+    ratio = data.get('tome_ratio')
+    if ratio is not None and (not isinstance(ratio, (int, float)) or not 0.0 <= ratio <= MAX_TOME_RATIO):
+        return None, f"tome_ratio must be between 0 and {MAX_TOME_RATIO}"
+    return sd_service.token_merging.resolve(ratio), None
+
+def parse_keep_latents(data):
+    """Whether the client asked for a latent handle, returns (flag, error)"""
+    keep = data.get('keep_latents', False)
+    if not isinstance(keep, bool):
+        return None, "keep_latents must be true or false"
+    return keep, None
+
+def parse_generation_params(data):
+    """Validate a generation payload, returns (params, error)"""
+    prompt = data.get('prompt')
+    if not prompt:
+        return None, "No prompt provided"
+    
+    steps = data.get('steps', 10)  # Use fewer steps for faster generation
+    width = data.get('width', 512)
+    height = data.get('height', 512)
+    
+    # Validate parameters
+    steps = max(1, min(steps, 50))  # Limit steps to reasonable range
+    width = max(128, min(width, 1024))  # Limit width
+    height = max(128, min(height, 1024))  # Limit height
+    
+    priority = data.get('priority', 'normal')
+    if priority not in PRIORITY_CLASSES:
+        return None, f"Unknown priority '{priority}', expected one of {', '.join(PRIORITY_CLASSES)}"
+    
+    # A missing seed is resolved in enqueue_generation, where a pooled sprite may supply one
+    seed = data.get('seed')
+    if seed is not None and (not isinstance(seed, int) or seed < 0):
+        return None, "Seed must be a non-negative integer"
+    
+    scheduler, error = parse_scheduler(data)
+    if error:
+        return None, error
+    tome_ratio, error = parse_tome_ratio(data)
+    if error:
+        return None, error
+    
+    quality = data.get('quality', 'full')
+    if quality not in QUALITY_LEVELS:
+        return None, f"Unknown quality '{quality}', expected one of {', '.join(QUALITY_LEVELS)}"
+    keep, error = parse_keep_latents(data)
+    if error:
+        return None, error
+    
+    return {"prompt": prompt, "steps": steps, "width": width, "height": height,
+            "priority": priority, "seed": seed, "scheduler": scheduler, "tome_ratio": tome_ratio, "quality": quality,
+            "keep_latents": keep}, None
+
+def keep_latents(latents, wanted, **meta):
+    """Store final latents when the client asked for a latent handle, returns the handle or None"""
+    if not wanted or latents is None:
+        return None
+    return latent_store.put(latents, **meta)
+
+def resolve_init_source(data):
+    """Find the img2img source: a stored latent handle or a base64 image, returns (image, latents, width, height, error)"""
+    handle = data.get('latent_handle')
+    if handle:
+        entry = latent_store.get(handle)
+        if entry is None:
+            return None, None, None, None, "Unknown or expired latent handle"
+        latents, meta = entry
+        return None, latents, meta["width"], meta["height"], None
+    
+    if not data.get('image'):
+        return None, None, None, None, "No init image or latent_handle provided"
+    from PIL import Image
+    init_image = Image.open(io.BytesIO(base64.b64decode(data['image'])))
+    width = max(128, min(data.get('width', 512), 1024))
+    height = max(128, min(data.get('height', 512), 1024))
+    return init_image, None, width, height, None
+
 @app.route('/generate', methods=['POST'])
 def generate():
     """Generate image from text prompt"""
@@ -576,18 +1155,10 @@ def generate():
         
         print(f"   JSON Payload: {data}")
         
-        prompt = data.get('prompt')
-        if not prompt:
-            return jsonify({"success": False, "error": "No prompt provided"}), 400
-        
-        steps = data.get('steps', 10)  # Use fewer steps for faster generation
-        width = data.get('width', 512)
-        height = data.get('height', 512)
-        
-        # Validate parameters
-        steps = max(1, min(steps, 50))  # Limit steps to reasonable range
-        width = max(128, min(width, 1024))  # Limit width
-        height = max(128, min(height, 1024))  # Limit height
+        params, error_msg = parse_generation_params(data)
+        if error_msg:
+            return jsonify({"success": False, "error": error_msg}), 400
+        prompt, steps, width, height = params["prompt"], params["steps"], params["width"], params["height"]
         
         print(f"[GENERATION START]")
         print(f"   Prompt: '{prompt}'")
@@ -595,25 +1166,24 @@ def generate():
         print(f"   Client: {request.headers.get('User-Agent', 'Unknown')[:50]}...")
         start_time = time.time()
         
-        image, error_msg = sd_service.generate_image(prompt, steps, width, height)
+        generation = enqueue_generation(params)
+        image, error_msg = wait_for_generation(generation)
         generation_time = time.time() - start_time
         
         if image:
-            # Convert PIL image to base64
-            import io
-            import base64
-            
-            buffer = io.BytesIO()
-            image.save(buffer, format='PNG')
-            image_b64 = base64.b64encode(buffer.getvalue()).decode()
-            
             return jsonify({
                 "success": True,
-                "image": image_b64,
+                "image": image_to_b64(image),
                 "prompt": prompt,
                 "steps": steps,
                 "width": width,
                 "height": height,
+                "seed": params["seed"],
+                "scheduler": params["scheduler"],
+                "tome_ratio": params["tome_ratio"],
+                "quality": params["quality"],
+                "cache": generation.cache_status,
+                "latent_handle": keep_latents(generation.latents, params["keep_latents"], width=width, height=height),
                 "generation_time": round(generation_time, 3),
                 "device": sd_service.device,
                 "model_type": "StableDiffusionPipeline",
@@ -632,7 +1202,321 @@ def generate():
         traceback.print_exc()
         return jsonify({"success": False, "error": str(e)}), 500
 
+def sse_event(event, payload):
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+@app.route('/generate/stream', methods=['POST'])
+def generate_stream():
+    """Generate image from text prompt, streaming per-step progress and latent previews as server-sent events"""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"success": False, "error": "No JSON data provided"}), 400
+    
+    params, error_msg = parse_generation_params(data)
+    if error_msg:
+        return jsonify({"success": False, "error": error_msg}), 400
+    preview_every = max(1, int(data.get('preview_every', PREVIEW_EVERY)))
+    
+    events = queue.Queue()
+    
+    def on_step(step, total_steps, latents):
+        # Runs on the dispatcher thread: only copy the small latent, encode on the HTTP thread
+        preview_latents = latents.detach().to("cpu", copy=True) if step % preview_every == 0 or step == total_steps else None
+        events.put((step, total_steps, preview_latents))
+    
+    start_time = time.time()
+    generation = enqueue_generation(params, on_step=on_step)
+    
+    def stream():
+        try:
+            yield from stream_events()
+        finally:
+            # GeneratorExit lands here when the client closes the stream early
+            if not generation.done.is_set():
+                print(f"[CANCELLED] Stream closed, cancelling '{params['prompt']}'")
+                sd_service.batcher.cancel(generation)
+    
+    def stream_events():
+        yield sse_event("queued", {"queue_position": sd_service.batcher.queue_position(generation), **params})
+        while True:
+            try:
+                step, total_steps, preview_latents = events.get(timeout=0.25)
+            except queue.Empty:
+                if generation.done.is_set() and events.empty():
+                    break
+                continue
+            yield sse_event("progress", {
+                "step": step,
+                "total_steps": total_steps,
+                "progress": round(step / total_steps, 3),
+                "elapsed": round(time.time() - start_time, 3)
+            })
+            if preview_latents is not None:
+                yield sse_event("preview", {
+                    "step": step,
+                    "image": preview_b64(preview_latents, size=(params["width"] // 4, params["height"] // 4))
+                })
+        
+        generation_time = time.time() - start_time
+        if generation.image is not None:
+            yield sse_event("result", {
+                "success": True,
+                "image": image_to_b64(generation.image),
+                "cache": generation.cache_status,
+                "latent_handle": keep_latents(generation.latents, params["keep_latents"],
+                                              width=params["width"], height=params["height"]),
+                "generation_time": round(generation_time, 3),
+                "device": sd_service.device,
+                **params
+            })
+        else:
+            yield sse_event("error", {
+                "success": False,
+                "error": generation.error or "Image generation failed",
+                "generation_time": round(generation_time, 3)
+            })
+    
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/img2img', methods=['POST'])
+def img2img():
+    """Refine a base64 image, or the latents behind a latent_handle, with a text prompt"""
+    try:
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({"success": False, "error": "No JSON data provided"}), 400
+        
+        prompt = data.get('prompt')
+        if not prompt:
+            return jsonify({"success": False, "error": "No prompt provided"}), 400
+        strength = data.get('strength', 0.75)
+        if not isinstance(strength, (int, float)) or not 0.0 < strength <= 1.0:
+            return jsonify({"success": False, "error": "Strength must be in (0, 1]"}), 400
+        steps = max(1, min(data.get('steps', 10), 50))
+        scheduler, error_msg = parse_scheduler(data)
+        if error_msg:
+            return jsonify({"success": False, "error": error_msg}), 400
+        tome_ratio, error_msg = parse_tome_ratio(data)
+        if error_msg:
+            return jsonify({"success": False, "error": error_msg}), 400
+        keep, error_msg = parse_keep_latents(data)
+        if error_msg:
+            return jsonify({"success": False, "error": error_msg}), 400
+        
+        init_image, init_latents, width, height, error_msg = resolve_init_source(data)
+        if error_msg:
+            return jsonify({"success": False, "error": error_msg}), 400
+        
+        start_time = time.time()
+        latents, error_msg = sd_service.img2img_latents(prompt, init_image, strength, steps, width, height,
+                                                        init_latents=init_latents, scheduler=scheduler,
+                                                        tome_ratio=tome_ratio)
+        images = None
+        if not error_msg:
+            images, error_msg = sd_service._decode_or_error(latents)
+        generation_time = time.time() - start_time
+        
+        if not images:
+            return jsonify({
+                "success": False,
+                "error": error_msg or "Img2img generation failed",
+                "generation_time": round(generation_time, 3)
+            }), 500
+        
+        return jsonify({
+            "success": True,
+            "image": image_to_b64(images[0]),
+            "prompt": prompt,
+            "strength": strength,
+            "steps": steps,
+            "width": width,
+            "height": height,
+            "scheduler": scheduler,
+            "tome_ratio": tome_ratio,
+            "latent_handle": keep_latents(latents, keep, width=width, height=height),
+            "generation_time": round(generation_time, 3),
+            "device": sd_service.device
+        })
+        
+    except Exception as e:
+        print(f"Img2img endpoint error: {e}")
+        traceback.print_exc()
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/img2img/sweep', methods=['POST'])
+def img2img_sweep():
+    """Run several (strength, prompt) img2img variations of one base64 image as one batched job"""
+    try:
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({"success": False, "error": "No JSON data provided"}), 400
+        variations = []
+        for variation in data.get('variations') or []:
+            strength = variation.get('strength')
+            prompt = variation.get('prompt')
+            if not prompt or not isinstance(strength, (int, float)) or not 0.0 < strength <= 1.0:
+                return jsonify({"success": False, "error": "Each variation needs a prompt and a strength in (0, 1]"}), 400
+            variations.append((float(strength), prompt))
+        if not variations:
+            return jsonify({"success": False, "error": "No variations provided"}), 400
+        
+        steps = max(1, min(data.get('steps', 10), 50))
+        seed = data.get('seed', 42)
+        scheduler, error_msg = parse_scheduler(data)
+        if error_msg:
+            return jsonify({"success": False, "error": error_msg}), 400
+        tome_ratio, error_msg = parse_tome_ratio(data)
+        if error_msg:
+            return jsonify({"success": False, "error": error_msg}), 400
+        
+        init_image, init_latents, width, height, error_msg = resolve_init_source(data)
+        if error_msg:
+            return jsonify({"success": False, "error": error_msg}), 400
+        
+        start_time = time.time()
+        images, error_msg = sd_service.img2img_sweep(init_image, variations, steps, width, height, seed,
+                                                     init_latents=init_latents, scheduler=scheduler,
+                                                     tome_ratio=tome_ratio)
+        generation_time = time.time() - start_time
+        
+        if images is None:
+            return jsonify({
+                "success": False,
+                "error": error_msg or "Img2img sweep failed",
+                "generation_time": round(generation_time, 3)
+            }), 500
+        
+        return jsonify({
+            "success": True,
+            "results": [
+                {"strength": strength, "prompt": prompt, "image": image_to_b64(image)}
+                for (strength, prompt), image in zip(variations, images)
+            ],
+            "steps": steps,
+            "width": width,
+            "height": height,
+            "seed": seed,
+            "scheduler": scheduler,
+            "tome_ratio": tome_ratio,
+            "generation_time": round(generation_time, 3),
+            "device": sd_service.device
+        })
+        
+    except Exception as e:
+        print(f"Img2img sweep endpoint error: {e}")
+        traceback.print_exc()
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/pool', methods=['GET'])
+def pool_status():
+    """Report sprite pool fill levels"""
+    return jsonify({"success": True, **sprite_pool.stats()})
+
+@app.route('/pool', methods=['POST'])
+def pool_register():
+    """Register a prompt template to pre-render while the service is idle"""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"success": False, "error": "No JSON data provided"}), 400
+    
+    params, error_msg = parse_generation_params(data)
+    if error_msg:
+        return jsonify({"success": False, "error": error_msg}), 400
+    
+    sprite_pool.register(params["prompt"], params["steps"], params["width"], params["height"], params["scheduler"],
+                         params["tome_ratio"])
+    return jsonify({"success": True, **sprite_pool.stats()})
+
+@app.route('/tome', methods=['GET'])
+def tome_status():
+    """Report the token merging state"""
+    return jsonify({"success": True, **sd_service.token_merging.stats()})
+
+@app.route('/tome', methods=['POST'])
+def tome_configure():
+    """Change the server-wide token merging ratio; 0 removes the patch from the UNet"""
+    data = request.get_json(silent=True)
+    if not data or 'ratio' not in data:
+        return jsonify({"success": False, "error": "No ratio provided"}), 400
+    ratio = data['ratio']
+    if not isinstance(ratio, (int, float)) or not 0.0 <= ratio <= MAX_TOME_RATIO:
+        return jsonify({"success": False, "error": f"ratio must be between 0 and {MAX_TOME_RATIO}"}), 400
+    if not sd_service.token_merging.supported:
+        return jsonify({"success": False, "error": "Token merging is not available on this backend"}), 409
+    
+    sd_service.token_merging.set_default(float(ratio))
+    return jsonify({"success": True, **sd_service.token_merging.stats()})
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Queue a generation and return a job id immediately"""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"success": False, "error": "No JSON data provided"}), 400
+    
+    params, error_msg = parse_generation_params(data)
+    if error_msg:
+        return jsonify({"success": False, "error": error_msg}), 400
+    
+    job = job_store.create(params)
+    if job is None:
+        return jsonify({"success": False, "error": "Job queue is full, try again later"}), 429
+    
+    print(f"[JOB QUEUED] {job.id}: '{params['prompt']}' ({params['steps']} steps, {params['width']}x{params['height']})")
+    return jsonify({
+        "success": True,
+        "job_id": job.id,
+        "status": job.status(),
+        "queue_position": job_store.queue_position(job),
+        "eta_seconds": job_store.eta_seconds(job),
+        "status_url": f"/jobs/{job.id}"
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Report job status, queue position, ETA and, once finished, the result"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Unknown or expired job id"}), 404
+    
+    status = job.status()
+    response = {
+        "success": status not in ("failed", "cancelled"),
+        "job_id": job.id,
+        "status": status,
+        "queue_position": job_store.queue_position(job),
+        "eta_seconds": job_store.eta_seconds(job),
+        "progress": round(job.request.progress(), 3),
+        **job.params
+    }
+    if status == "completed":
+        response["image"] = job.image_b64()
+        response["generation_time"] = round(job.request.finished_at - job.created_at, 3)
+        response["cache"] = job.request.cache_status
+        response["device"] = sd_service.device
+        if job.latent_handle is None:
+            job.latent_handle = keep_latents(job.request.latents, job.params["keep_latents"],
+                                             width=job.params["width"], height=job.params["height"])
+        response["latent_handle"] = job.latent_handle
+    elif status in ("failed", "cancelled"):
+        response["error"] = job.request.error or "Image generation failed"
+    return jsonify(response)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running job at the next denoising step"""
+    job = job_store.cancel(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Unknown or expired job id"}), 404
+    print(f"[JOB CANCELLED] {job.id}")
+    return jsonify({"success": True, "job_id": job.id, "status": job.status()})
+
 if __name__ == '__main__':
     print(f"Starting AI Art Service v{VERSION}")
     print("Service available at http://localhost:8080")
+    if warmup is not None:
+        # Load and warm up in the background so /health answers while the model loads
+        warmup.start()
     app.run(host='localhost', port=8080, debug=False)
\ No newline at end of file
@@ -0,0 +1,277 @@
+"""Micro-batching dispatcher that merges concurrent txt2img requests into one pipeline call"""
+
+import bisect
+import threading
+import time
+import traceback
+
+CANCELLED_ERROR = "Generation cancelled"
+
+# Request priority classes, most urgent first; bulk work may be preempted at a step boundary
+PRIORITY_CLASSES = ("interactive", "normal", "bulk")
+
+# Decode quality: the full VAE, or a tiny distilled autoencoder for throwaway previews
+QUALITY_LEVELS = ("full", "preview")
+
+
+class GenerationCancelled(Exception):
+    """Raised from a step callback to abort a pipeline run whose requests were all cancelled"""
+
+
+class GenerationRequest:
+    """A single txt2img request waiting in the dispatcher queue"""
+
+    def __init__(self, prompt, steps, width, height, on_step=None, priority="normal", seed=None, scheduler=None,
+                 tome_ratio=None, quality="full"):
+        self.prompt = prompt
+        self.steps = steps
+        self.width = width
+        self.height = height
+        self.seed = seed
+        self.scheduler_name = scheduler
+        self.tome_ratio = tome_ratio
+        self.quality = quality
+        self.priority = priority
+        self.priority_rank = PRIORITY_CLASSES.index(priority)
+        self.suspended = False
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.image = None
+        self.latents = None
+        self.error = None
+        self.done = threading.Event()
+        self.cancelled = threading.Event()
+        self.step_listeners = [on_step] if on_step else []
+        self.step = 0
+        self.total_steps = None
+        self.cache_status = "miss"
+        self.done_callbacks = []
+        self.finish_lock = threading.Lock()
+
+    def queue_order(self):
+        """Sort key for dispatcher queues: priority class first, then arrival time"""
+        return (self.priority_rank, self.submitted_at)
+
+    def is_preemptible(self):
+        return self.priority == "bulk"
+
+    def raise_priority(self, priority):
+        """Move to a more urgent priority class; returns False (and changes nothing) if it is not more urgent"""
+        rank = PRIORITY_CLASSES.index(priority)
+        if rank >= self.priority_rank:
+            return False
+        self.priority = priority
+        self.priority_rank = rank
+        return True
+
+    def root(self):
+        """The request actually queued on the dispatcher (differs for coalesced requests)"""
+        return self
+
+    def batch_key(self):
+        """Requests can only share a pipeline call when size, step count, scheduler, token merging and decoder match"""
+        return (self.width, self.height, self.steps, self.scheduler_name, self.tome_ratio, self.quality)
+
+    def progress(self):
+        """Fraction of the denoising work completed so far"""
+        if self.done.is_set():
+            return 1.0
+        if not self.total_steps:
+            return 0.0
+        return self.step / self.total_steps
+
+    def add_step_listener(self, listener):
+        """Call listener(step, total_steps, latents) after every denoising step"""
+        self.step_listeners.append(listener)
+
+    def notify_step(self, step, total_steps, latents):
+        """Record denoising progress and hand this request's latents to its step listeners"""
+        self.step = step
+        self.total_steps = total_steps
+        for listener in self.step_listeners:
+            try:
+                listener(step, total_steps, latents)
+            except Exception as e:
+                # A broken listener must never take down the shared batch
+                print(f"Warning: step listener failed: {e}")
+
+    def cancel(self):
+        """Ask the dispatcher to stop working on this request at the next step boundary"""
+        self.cancelled.set()
+
+    def is_cancelled(self):
+        return self.cancelled.is_set()
+
+    def add_done_callback(self, callback):
+        """Call callback(request) once the request finishes, immediately if it already has"""
+        with self.finish_lock:
+            if not self.done.is_set():
+                self.done_callbacks.append(callback)
+                return
+        callback(self)
+
+    def finish(self, image, error=None, latents=None):
+        with self.finish_lock:
+            if self.done.is_set():
+                # Cancelled requests are finished early; ignore the late result of their batch
+                return
+            self.finished_at = time.time()
+            self.image = image
+            self.latents = latents
+            self.error = error
+            self.done.set()
+            callbacks = list(self.done_callbacks)
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"Warning: done callback failed: {e}")
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            return None, f"Timed out after {timeout}s waiting for generation"
+        return self.image, self.error
+
+
+class MicroBatcher:
+    """Holds requests for a short window and runs compatible ones as a single batch"""
+
+    def __init__(self, service, window_ms=50, max_batch_size=4):
+        self.service = service
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self.pending = []
+        self.running = False
+        self.condition = threading.Condition()
+        self.worker = None
+
+    def submit(self, prompt, steps, width, height, timeout=None):
+        """Queue a request and block until its image (or error) is ready"""
+        return self.enqueue(prompt, steps, width, height).wait(timeout)
+
+    def enqueue(self, prompt, steps, width, height, on_step=None, priority="normal", seed=None, scheduler=None,
+                tome_ratio=None, quality="full"):
+        """Queue a request without waiting for it"""
+        request = GenerationRequest(prompt, steps, width, height, on_step=on_step, priority=priority,
+                                    seed=seed, scheduler=scheduler, tome_ratio=tome_ratio, quality=quality)
+        with self.condition:
+            bisect.insort(self.pending, request, key=GenerationRequest.queue_order)
+            self._ensure_worker()
+            self.condition.notify()
+        return request
+
+    def queue_depth(self):
+        with self.condition:
+            return len(self.pending)
+
+    def is_idle(self):
+        """True when nothing is queued or running"""
+        with self.condition:
+            return not self.pending and not self.running
+
+    def queue_position(self, request):
+        """Number of requests queued ahead of this one, or 0 once it is running"""
+        request = request.root()
+        with self.condition:
+            if request in self.pending:
+                return self.pending.index(request)
+            return 0
+
+    def cancel(self, request):
+        """Cancel a request; queued ones are dropped now, running ones at the next step"""
+        request.cancel()
+        with self.condition:
+            queued = request in self.pending
+            if queued:
+                self.pending.remove(request)
+        # Finished outside the condition: done callbacks may take other locks (single-flight)
+        if queued:
+            request.finish(None, CANCELLED_ERROR)
+
+    def promote(self, request, priority):
+        """Raise a queued request to a more urgent priority class"""
+        with self.condition:
+            if request.raise_priority(priority) and request in self.pending:
+                self.pending.sort(key=GenerationRequest.queue_order)
+                self.condition.notify()
+
+    def _ensure_worker(self):
+        # Started lazily so demo scripts that only call generate_image never spawn a thread
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(target=self._run, name="sd-micro-batcher", daemon=True)
+            self.worker.start()
+
+    def _matching(self, key):
+        return [r for r in self.pending if r.batch_key() == key]
+
+    def _next_batch(self):
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+
+            # The queue is kept in priority order, so the head is the most urgent, oldest request.
+            # The window is measured from its arrival so nobody waits longer than one window
+            oldest = self.pending[0]
+            key = oldest.batch_key()
+            deadline = oldest.submitted_at + self.window
+            while len(self._matching(key)) < self.max_batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            batch = self._matching(key)[:self.max_batch_size]
+            for r in batch:
+                self.pending.remove(r)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            self.running = True
+            try:
+                self._execute(batch)
+            finally:
+                self.running = False
+
+    def _execute(self, batch):
+        first = batch[0]
+        started_at = time.time()
+        for r in batch:
+            r.started_at = started_at
+        print(f"[BATCH] Running {len(batch)} request(s) at {first.width}x{first.height}, {first.steps} steps")
+        try:
+            latents, error = self.service.generate_batch_latents(
+                [r.prompt for r in batch], first.steps, first.width, first.height,
+                step_callback=self._step_callback(batch), seeds=[r.seed for r in batch],
+                scheduler=first.scheduler_name, tome_ratio=first.tome_ratio
+            )
+            images = None
+            if not error:
+                images, error = self.service._decode_or_error(latents, first.quality)
+        except Exception as e:
+            traceback.print_exc()
+            images, error = None, f"Batch dispatch error: {e}"
+
+        if error or not images or len(images) != len(batch):
+            for r in batch:
+                r.finish(None, error or "Image generation failed")
+            return
+
+        for i, (r, image) in enumerate(zip(batch, images)):
+            r.finish(image, latents=latents[i:i + 1])
+
+    def _step_callback(self, batch):
+        """Fan per-step pipeline progress out to each request's slice of the latents"""
+        def callback(step, total_steps, latents):
+            for i, r in enumerate(batch):
+                if r.is_cancelled():
+                    r.finish(None, CANCELLED_ERROR)
+                    continue
+                r.notify_step(step, total_steps, latents[i:i + 1])
+            # Cancelled requests stop waiting immediately, but the shared pipeline call
+            # can only be aborted once nobody in the batch still wants its image
+            if all(r.is_cancelled() for r in batch):
+                raise GenerationCancelled()
+        return callback
@@ -25,30 +25,48 @@ transformations = [
     (0.8, "portrait of a mature Asian man in his 50s with short black hair, warm smile, masculine features, detailed realistic style, professional lighting")
 ]
 
-print(f"\nStarting transformation sequence...")
-print(f"Original: Female Asian portrait")
+def run_variations(variations, filename_pattern):
+    """Generate the variations as separate img2img calls, then as one sweep, and compare the timings"""
+    # Baseline: one full img2img call per strength
+    start = time.time()
+    for strength, prompt in variations:
+        result_image, error = service.img2img_generate(
+            prompt=prompt,
+            init_image=input_image,
+            strength=strength,
+            steps=10,
+            width=512,  # Keep original resolution for better quality
+            height=512
+        )
+        if not result_image:
+            print(f"FAILED: {error}")
+            return
+    separate_time = time.time() - start
+    print(f"\nSeparate calls: {len(variations)} images in {separate_time:.1f}s")
 
-for i, (strength, prompt) in enumerate(transformations, 1):
-    print(f"\n--- Transformation {i}: Strength {strength} ---")
-    print(f"Target: {prompt[:60]}...")
-    
+    # All strengths run as one batched job sharing the encoded portrait
     start = time.time()
-    result_image, error = service.img2img_generate(
-        prompt=prompt,
+    result_images, error = service.img2img_sweep(
         init_image=input_image,
-        strength=strength,
+        variations=variations,
         steps=10,
-        width=512,  # Keep original resolution for better quality
+        width=512,
         height=512
     )
-    gen_time = time.time() - start
-    
-    if result_image:
-        filename = f"gender_transform_step_{i}_strength_{strength}.png"
-        result_image.save(filename)
-        print(f"SUCCESS: Generated in {gen_time:.1f}s -> {filename}")
-    else:
+    sweep_time = time.time() - start
+    if not result_images:
         print(f"FAILED: {error}")
+        return
+    print(f"Sweep:          {len(variations)} images in {sweep_time:.1f}s ({separate_time / sweep_time:.1f}x faster)")
+
+    for i, ((strength, prompt), result_image) in enumerate(zip(variations, result_images), 1):
+        filename = filename_pattern.format(step=i, strength=strength)
+        result_image.save(filename)
+        print(f"SUCCESS: Step {i}, strength {strength}, {prompt[:60]}... -> {filename}")
+
+print(f"\nStarting transformation sequence...")
+print(f"Original: Female Asian portrait")
+run_variations(transformations, "gender_transform_step_{step}_strength_{strength}.png")
 
 # Also create a side-by-side comparison
 print(f"\n--- Creating progressive sequence ---")
@@ -58,26 +76,7 @@ sequence_prompts = [
     (0.7, "portrait of an elegant Asian man in his 50s with short black hair, gentle masculine features, detailed realistic style")
 ]
 
-for i, (strength, prompt) in enumerate(sequence_prompts, 4):
-    print(f"\nSequence step {i-3}: Strength {strength}")
-    
-    start = time.time()
-    result_image, error = service.img2img_generate(
-        prompt=prompt,
-        init_image=input_image,
-        strength=strength,
-        steps=10,
-        width=512,
-        height=512
-    )
-    gen_time = time.time() - start
-    
-    if result_image:
-        filename = f"gender_sequence_step_{i-3}_strength_{strength}.png"
-        result_image.save(filename)
-        print(f"SUCCESS: Generated in {gen_time:.1f}s -> {filename}")
-    else:
-        print(f"FAILED: {error}")
+run_variations(sequence_prompts, "gender_sequence_step_{step}_strength_{strength}.png")
 
 print(f"\n=== GENDER TRANSFORMATION COMPLETE ===")
 print("Generated transformation sequence:")
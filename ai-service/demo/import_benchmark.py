@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Measure what importing app.py costs and how quickly the server answers /health
+
+    python import_benchmark.py              # per-module import times, heavy-import check, time to liveness
+    python import_benchmark.py --no-server  # skip starting the server
+
+Every measurement runs in a fresh interpreter. Exits with status 1 when importing app.py pulls in
+one of HEAVY_MODULES, so a stray top-level import shows up as a failure rather than a slow startup.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("torch", "diffusers", "transformers", "onnxruntime", "tomesd", "psutil", "numpy")
+HEALTH_URL = "http://localhost:8080/health"
+TOP = 15
+
+
+def import_times():
+    """{module: cumulative microseconds} for app and everything it imports directly, from python -X importtime"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=SERVICE_DIR,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(f"import app failed:\n{result.stderr[-2000:]}")
+    times = {}
+    children = {}
+    for line in result.stderr.splitlines():
+        # "import time:      self [us] |  cumulative | imported package", nesting shown by indentation
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        # A module's imports are listed before the module itself
+        if depth == 1:
+            children[name.strip()] = int(cumulative)
+        elif depth == 0:
+            if name.strip() == "app":
+                times = {"app": int(cumulative), **children}
+            children = {}
+    return times
+
+
+def heavy_imports():
+    """Which HEAVY_MODULES are loaded after `import app`"""
+    code = f"import sys, json, app; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=SERVICE_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(f"import app failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def time_to_liveness(timeout=60.0):
+    """Seconds from launching app.py until /health answers 200"""
+    start = time.time()
+    server = subprocess.Popen([sys.executable, "app.py"], cwd=SERVICE_DIR,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.time() - start < timeout:
+            if server.poll() is not None:
+                sys.exit("app.py exited before answering /health")
+            try:
+                with urllib.request.urlopen(HEALTH_URL, timeout=1) as response:
+                    if response.status == 200:
+                        return time.time() - start
+            except OSError:
+                time.sleep(0.02)
+        sys.exit(f"/health did not answer within {timeout:.0f}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    print("=== APP IMPORT BENCHMARK ===\n")
+
+    times = import_times()
+    print(f"import app: {times.get('app', 0) / 1000:.1f} ms total\n")
+    print("Slowest imports (cumulative, including what they import):")
+    for name, micros in sorted(times.items(), key=lambda item: -item[1])[:TOP]:
+        if name != "app":
+            print(f"  {micros / 1000:8.1f} ms  {name}")
+
+    heavy = heavy_imports()
+    print(f"\nHeavy modules loaded by import app: {', '.join(heavy) if heavy else 'none'}")
+
+    if "--no-server" not in sys.argv:
+        print(f"\nTime to first /health 200: {time_to_liveness():.2f} s")
+
+    if heavy:
+        print("\nFAIL: import app must not load heavy ML modules; import them where they are used")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Benchmark dynamic INT8 quantization against float32 on CPU: latency, RSS and image quality
+
+Each mode runs in its own process so model memory does not overlap:
+
+    python quantization_benchmark.py            # runs both modes and compares
+    python quantization_benchmark.py --worker int8 out_dir   # one mode only (used internally)
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+PROMPTS = [
+    "pixel art flower, game sprite",
+    "a small cute robot with glowing blue eyes, detailed metallic surface",
+    "a serene forest landscape with a waterfall",
+]
+SEEDS = [1, 2, 3]
+STEPS = 10
+SIZE = 512
+
+
+def run_worker(mode, out_dir):
+    """Load the service in one mode, generate the fixed prompt set and write <mode>.json metrics"""
+    os.environ["SD_QUANTIZE"] = mode
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import psutil
+    from app import StableDiffusionService
+
+    process = psutil.Process()
+    service = StableDiffusionService()
+    if service.device != "cpu":
+        print(f"WARNING: running on {service.device}; INT8 mode only applies on CPU")
+
+    start = time.time()
+    if not service.load_model():
+        sys.exit(f"Failed to load model in {mode} mode")
+    load_time = time.time() - start
+    peak_rss = process.memory_info().rss
+
+    # One untimed run so lazy initialization is not billed to the first prompt
+    service.generate_image(PROMPTS[0], steps=2, width=SIZE, height=SIZE, seed=0)
+
+    latencies = []
+    for index, (prompt, seed) in enumerate(zip(PROMPTS, SEEDS)):
+        start = time.time()
+        image, error = service.generate_image(prompt, steps=STEPS, width=SIZE, height=SIZE, seed=seed)
+        latencies.append(time.time() - start)
+        peak_rss = max(peak_rss, process.memory_info().rss)
+        if image is None:
+            sys.exit(f"Generation failed in {mode} mode: {error}")
+        image.save(os.path.join(out_dir, f"{mode}_{index}.png"))
+        print(f"[{mode}] {latencies[-1]:.2f}s  '{prompt}'")
+
+    with open(os.path.join(out_dir, f"{mode}.json"), "w") as f:
+        json.dump({
+            "mode": mode,
+            "quantization": service.quantization,
+            "load_time": load_time,
+            "latencies": latencies,
+            "peak_rss_gb": peak_rss / (1024**3),
+        }, f)
+
+
+def image_quality(reference_path, candidate_path):
+    """PSNR and SSIM of a candidate image against the float32 reference"""
+    import numpy as np
+    from PIL import Image
+    from skimage.metrics import structural_similarity
+
+    reference = np.asarray(Image.open(reference_path).convert("RGB"), dtype=np.float64)
+    candidate = np.asarray(Image.open(candidate_path).convert("RGB"), dtype=np.float64)
+    mse = np.mean((reference - candidate) ** 2)
+    psnr = float("inf") if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+    ssim = structural_similarity(reference, candidate, channel_axis=2, data_range=255.0)
+    return psnr, ssim
+
+
+def main():
+    out_dir = os.path.abspath("quantization_benchmark")
+    os.makedirs(out_dir, exist_ok=True)
+
+    print("=== INT8 QUANTIZATION BENCHMARK ===")
+    print(f"{len(PROMPTS)} prompts, {STEPS} steps, {SIZE}x{SIZE}\n")
+
+    results = {}
+    for mode in ("none", "int8"):
+        print(f"--- {mode} ---")
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", mode, out_dir], check=True)
+        with open(os.path.join(out_dir, f"{mode}.json")) as f:
+            results[mode] = json.load(f)
+
+    fp32, int8 = results["none"], results["int8"]
+    if int8["quantization"] != "int8":
+        print("\nWARNING: INT8 mode was not applied (not on CPU?), comparison is meaningless")
+
+    fp32_latency = sum(fp32["latencies"]) / len(fp32["latencies"])
+    int8_latency = sum(int8["latencies"]) / len(int8["latencies"])
+    print("\n=== RESULTS ===")
+    print(f"{'':12} {'fp32':>10} {'int8':>10} {'change':>10}")
+    print(f"{'load (s)':12} {fp32['load_time']:>10.2f} {int8['load_time']:>10.2f} "
+          f"{int8['load_time'] / fp32['load_time']:>9.2f}x")
+    print(f"{'latency (s)':12} {fp32_latency:>10.2f} {int8_latency:>10.2f} {fp32_latency / int8_latency:>9.2f}x faster")
+    print(f"{'peak RSS (GB)':12} {fp32['peak_rss_gb']:>10.2f} {int8['peak_rss_gb']:>10.2f} "
+          f"{int8['peak_rss_gb'] - fp32['peak_rss_gb']:>+10.2f}")
+
+    print("\nQuality vs fp32 (same prompt and seed):")
+    for index, prompt in enumerate(PROMPTS):
+        psnr, ssim = image_quality(os.path.join(out_dir, f"none_{index}.png"), os.path.join(out_dir, f"int8_{index}.png"))
+        print(f"  PSNR {psnr:6.2f} dB  SSIM {ssim:.3f}  '{prompt}'")
+    print(f"\nImages saved in {out_dir}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--worker":
+        run_worker(sys.argv[2], sys.argv[3])
+    else:
+        main()
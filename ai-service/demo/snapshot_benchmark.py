@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Benchmark cold start from the prepared pipeline snapshot against loading from the model registry source
+
+Every start runs in a fresh process, alternating between the two paths so both see a similarly
+warm OS page cache (drop it between runs for true cold-disk numbers):
+
+    python snapshot_benchmark.py            # builds the snapshot if needed, then compares
+    python snapshot_benchmark.py --worker snapshot out.json   # one start only (used internally)
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROUNDS = 3
+SIZE = 256
+
+
+def run_worker(mode, out_path):
+    """Start the service on one load path, load the model, generate one image and write timings to out_path"""
+    start = time.time()
+    os.environ["SD_SNAPSHOT"] = "1" if mode == "snapshot" else "0"
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from app import StableDiffusionService
+
+    service = StableDiffusionService()
+    import_time = time.time() - start
+
+    start = time.time()
+    if not service.load_model():
+        sys.exit(f"Failed to load model in {mode} mode")
+    load_time = time.time() - start
+
+    start = time.time()
+    image, error = service.generate_image("pixel art flower, game sprite", steps=2, width=SIZE, height=SIZE, seed=0)
+    if image is None:
+        sys.exit(f"Generation failed in {mode} mode: {error}")
+    first_image_time = time.time() - start
+
+    with open(out_path, "w") as f:
+        json.dump({
+            "mode": mode,
+            "source": service.model_source,
+            "model": service.model_id,
+            "import": import_time,
+            "load": load_time,
+            "first_image": first_image_time,
+        }, f)
+
+
+def start_once(mode):
+    with tempfile.TemporaryDirectory() as tmp:
+        out_path = os.path.join(tmp, "result.json")
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", mode, out_path], check=True)
+        with open(out_path) as f:
+            return json.load(f)
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    print("=== PIPELINE SNAPSHOT BENCHMARK ===")
+    print(f"{ROUNDS} starts per load path, first image {SIZE}x{SIZE} at 2 steps\n")
+
+    # Writes the snapshot if there is no usable one yet; not timed
+    print("--- preparing snapshot ---")
+    prepared = start_once("snapshot")
+    print(f"Model: {prepared['model']}\n")
+
+    results = {"registry": [], "snapshot": []}
+    for round_index in range(ROUNDS):
+        for mode in ("registry", "snapshot"):
+            print(f"--- {mode} start {round_index + 1}/{ROUNDS} ---")
+            result = start_once(mode)
+            if result["source"] != mode:
+                print(f"WARNING: {mode} start loaded from {result['source']}")
+            results[mode].append(result)
+
+    print("\n=== RESULTS (median) ===")
+    print(f"{'':16} {'registry':>10} {'snapshot':>10} {'speedup':>10}")
+    for metric in ("import", "load", "first_image"):
+        registry = median([r[metric] for r in results["registry"]])
+        snapshot = median([r[metric] for r in results["snapshot"]])
+        print(f"{metric + ' (s)':16} {registry:>10.2f} {snapshot:>10.2f} {registry / snapshot:>9.2f}x")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--worker":
+        run_worker(sys.argv[2], sys.argv[3])
+    else:
+        main()
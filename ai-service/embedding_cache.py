@@ -0,0 +1,69 @@
+"""LRU cache of CLIP text-encoder outputs so repeated prompts skip the text encoder"""
+
+import threading
+from collections import OrderedDict
+
+
+class PromptEmbeddingCache:
+    """Prompt embeddings keyed by token ids, plus the unconditional embedding for guidance"""
+
+    def __init__(self, max_items=256):
+        self.max_items = max_items
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.pipeline = None
+        self.device = None
+        self.unconditional = None
+        self.hits = 0
+        self.misses = 0
+
+    def reset(self, pipeline, device):
+        """Bind to a freshly loaded pipeline and encode the empty prompt once"""
+        with self.lock:
+            self.entries.clear()
+            self.pipeline = pipeline
+            self.device = device
+        self.unconditional = self._encode("")
+
+    def encode(self, prompt):
+        """Return the (1, tokens, dim) conditional embedding for prompt"""
+        key = self._token_key(prompt)
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        embeds = self._encode(prompt)
+        with self.lock:
+            self.entries[key] = embeds
+            while len(self.entries) > self.max_items:
+                self.entries.popitem(last=False)
+        return embeds
+
+    def encode_batch(self, prompts):
+        """Conditional and unconditional embeddings for a list of prompts, ready for prompt_embeds/negative_prompt_embeds"""
+        import torch
+        prompt_embeds = torch.cat([self.encode(prompt) for prompt in prompts])
+        negative_embeds = self.unconditional.expand(len(prompts), -1, -1)
+        return prompt_embeds, negative_embeds
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "items": len(self.entries)}
+
+    def _token_key(self, prompt):
+        # Token ids rather than raw text, so prompts differing only in case/spacing share an entry
+        tokenizer = self.pipeline.tokenizer
+        return tuple(tokenizer(
+            prompt, padding="max_length", max_length=tokenizer.model_max_length, truncation=True
+        ).input_ids)
+
+    def _encode(self, prompt):
+        import torch
+        # no_grad rather than inference_mode: cached tensors are reused across later pipeline calls
+        with torch.no_grad():
+            prompt_embeds, _ = self.pipeline.encode_prompt(prompt, self.device, 1, False)
+        return prompt_embeds
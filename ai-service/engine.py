@@ -0,0 +1,296 @@
+"""Continuous (step-level) batching engine for the txt2img denoising loop
+
+Instead of running whole requests one after another, the engine keeps a set of
+active requests and advances all of them by one denoising step per iteration.
+New requests join at any step boundary and finished ones leave immediately, so a
+5-step game sprite does not have to wait for a 64-step portrait to complete.
+"""
+
+import bisect
+import gc
+import threading
+import time
+import traceback
+
+from batching import CANCELLED_ERROR, GenerationRequest
+from schedulers import step_kwargs
+
+
+class DenoiseTask(GenerationRequest):
+    """A txt2img request plus its private denoising state"""
+
+    def __init__(self, prompt, steps, width, height, guidance_scale=7.5, on_step=None, priority="normal",
+                 seed=None, scheduler=None, tome_ratio=None, quality="full"):
+        super().__init__(prompt, steps, width, height, on_step=on_step, priority=priority,
+                         seed=seed, scheduler=scheduler, tome_ratio=tome_ratio, quality=quality)
+        self.guidance_scale = guidance_scale
+        self.scheduler = None
+        self.timesteps = None
+        self.step_index = 0
+        self.text_embeddings = None
+        # Seeded tasks keep their generator for the noise stochastic samplers add at every step
+        self.generator = None
+
+    def latent_shape(self):
+        return tuple(self.latents.shape)
+
+    def is_prepared(self):
+        """Suspended tasks keep their latents and scheduler and resume without re-encoding"""
+        return self.scheduler is not None
+
+    def is_finished(self):
+        return self.step_index >= len(self.timesteps)
+
+
+class ContinuousBatchingEngine:
+    """Advances every active request one step at a time in shared UNet calls"""
+
+    def __init__(self, service, max_batch_size=4):
+        self.service = service
+        self.max_batch_size = max(1, max_batch_size)
+        self.pending = []
+        self.active = []
+        self.suspended = []
+        self.condition = threading.Condition()
+        self.worker = None
+
+    def submit(self, prompt, steps, width, height, timeout=None):
+        """Queue a request and block until its image (or error) is ready"""
+        return self.enqueue(prompt, steps, width, height).wait(timeout)
+
+    def enqueue(self, prompt, steps, width, height, on_step=None, priority="normal", seed=None, scheduler=None,
+                tome_ratio=None, quality="full"):
+        """Queue a request without waiting for it"""
+        task = DenoiseTask(prompt, steps, width, height, on_step=on_step, priority=priority,
+                           seed=seed, scheduler=scheduler, tome_ratio=tome_ratio, quality=quality)
+        with self.condition:
+            bisect.insort(self.pending, task, key=DenoiseTask.queue_order)
+            self._ensure_worker()
+            self.condition.notify()
+        return task
+
+    def queue_depth(self):
+        with self.condition:
+            return len(self.pending)
+
+    def is_idle(self):
+        """True when nothing is queued, running or suspended"""
+        with self.condition:
+            return not self.pending and not self.active and not self.suspended
+
+    def queue_position(self, task):
+        """Number of requests queued ahead of this one, or 0 once it is running"""
+        task = task.root()
+        with self.condition:
+            if task in self.pending:
+                return self.pending.index(task)
+            return 0
+
+    def cancel(self, task):
+        """Cancel a request; it is dropped from the queue or the active batch at the next step boundary"""
+        task.cancel()
+        with self.condition:
+            queued = task in self.pending
+            if queued:
+                self.pending.remove(task)
+            self.condition.notify()
+        # Finished outside the condition: done callbacks may take other locks (single-flight)
+        if queued:
+            task.finish(None, CANCELLED_ERROR)
+
+    def promote(self, task, priority):
+        """Raise a waiting or running request to a more urgent priority class
+
+        Queued and suspended tasks are re-ordered at the next scheduling pass, and a running
+        task promoted out of bulk can no longer be preempted.
+        """
+        with self.condition:
+            if task.raise_priority(priority):
+                if task in self.pending:
+                    self.pending.sort(key=DenoiseTask.queue_order)
+                self.condition.notify()
+
+    def _ensure_worker(self):
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(target=self._run, name="sd-continuous-engine", daemon=True)
+            self.worker.start()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.active and not self.suspended:
+                    self.condition.wait()
+                cancelled = self._drop_cancelled()
+                admitted = self._schedule()
+
+            # Finished outside the condition: done callbacks may take other locks (single-flight)
+            for task in cancelled:
+                print(f"[ENGINE] Cancelled '{task.prompt}' at step {task.step_index}")
+                task.finish(None, CANCELLED_ERROR)
+
+            for task in admitted:
+                if task.is_prepared():
+                    task.suspended = False
+                    print(f"[ENGINE] Resumed '{task.prompt}' at step {task.step_index}")
+                    self.active.append(task)
+                elif self._admit(task):
+                    self.active.append(task)
+
+            if not self.active:
+                continue
+
+            # UNet calls can only batch latents of the same shape and token merging ratio,
+            # so each such combination in the active set gets its own batched step
+            groups = {}
+            for task in self.active:
+                groups.setdefault((task.latent_shape(), task.tome_ratio), []).append(task)
+            for group in groups.values():
+                self._step_group(group)
+
+            finished = [t for t in self.active if t.is_finished() and not t.done.is_set()]
+            if finished:
+                self._decode(finished)
+            self.active = [t for t in self.active if not t.done.is_set()]
+
+    def _drop_cancelled(self):
+        """Take cancelled requests out of every queue so their slots go to the next queued request
+
+        Called with the condition held; returns the cancelled tasks for the caller to finish once it is released.
+        """
+        cancelled = [t for t in self.pending + self.active + self.suspended if t.is_cancelled() and not t.done.is_set()]
+        self.pending = [t for t in self.pending if not t.is_cancelled() and not t.done.is_set()]
+        self.active = [t for t in self.active if not t.is_cancelled() and not t.done.is_set()]
+        self.suspended = [t for t in self.suspended if not t.is_cancelled() and not t.done.is_set()]
+        return cancelled
+
+    def _schedule(self):
+        """Pick the waiting tasks to run from the next step on, suspending bulk work if needed
+
+        Called with the condition held. Bulk work only runs while nothing more urgent is active
+        or waiting: sharing steps (or running the other resolution's group in between) would
+        still slow that work down, so running bulk tasks are suspended, keeping their latents
+        and scheduler state on the task object, and resumed once the urgent work has drained.
+        """
+        waiting = sorted(self.pending + self.suspended, key=DenoiseTask.queue_order)
+        if any(not t.is_preemptible() for t in self.active + waiting):
+            for victim in [t for t in self.active if t.is_preemptible()]:
+                self.active.remove(victim)
+                victim.suspended = True
+                self.suspended.append(victim)
+                print(f"[ENGINE] Suspended '{victim.prompt}' at step {victim.step_index} for higher-priority work")
+            waiting = [t for t in waiting if not t.is_preemptible()]
+
+        admitted = waiting[:max(0, self.max_batch_size - len(self.active))]
+        for task in admitted:
+            if task in self.pending:
+                self.pending.remove(task)
+            else:
+                self.suspended.remove(task)
+        return admitted
+
+    def _admit(self, task):
+        """Encode the prompt and build the request's own scheduler and initial latents"""
+        import torch
+        service = self.service
+        if not service.model_loaded and not service.load_model():
+            task.finish(None, "Model failed to load")
+            return False
+
+        _, memory_error = service._check_memory()
+        if memory_error:
+            task.finish(None, memory_error)
+            return False
+
+        try:
+            pipe = service.pipeline
+            with torch.inference_mode():
+                prompt_embeds, negative_embeds = service.embedding_cache.encode_batch([task.prompt])
+                task.text_embeddings = torch.cat([negative_embeds, prompt_embeds])
+
+                # Each task has its own scheduler instance, so different samplers can share a UNet batch
+                task.scheduler = service._new_scheduler(task.scheduler_name)
+                task.scheduler.set_timesteps(task.steps, device=service.device)
+                task.timesteps = task.scheduler.timesteps
+
+                shape = (
+                    1,
+                    pipe.unet.config.in_channels,
+                    task.height // pipe.vae_scale_factor,
+                    task.width // pipe.vae_scale_factor,
+                )
+                # A per-task generator keeps the noise independent of which requests share the batch
+                if task.seed is not None:
+                    task.generator = torch.Generator(device=service.device).manual_seed(task.seed)
+                task.latents = torch.randn(shape, generator=task.generator, device=service.device,
+                                           dtype=prompt_embeds.dtype)
+                task.latents = task.latents * task.scheduler.init_noise_sigma
+            task.started_at = time.time()
+            print(f"[ENGINE] Admitted '{task.prompt}' ({task.steps} steps, {task.width}x{task.height}), "
+                  f"{len(self.active) + 1} active")
+            return True
+        except Exception as e:
+            traceback.print_exc()
+            task.finish(None, f"Generation error: {e}")
+            return False
+
+    def _step_group(self, group):
+        """Run one denoising step for every task in the group with a single UNet call"""
+        import torch
+        service = self.service
+        pipe = service.pipeline
+        # Every task in a group has the same resolution
+        plan = service.memory_policy.plan(group[0].width, group[0].height, len(group))
+        try:
+            with torch.inference_mode():
+                model_inputs = []
+                timesteps = []
+                for task in group:
+                    t = task.timesteps[task.step_index]
+                    # Classifier-free guidance: unconditional and conditional halves per task
+                    latent_in = torch.cat([task.latents] * 2)
+                    model_inputs.append(task.scheduler.scale_model_input(latent_in, t))
+                    # Float so integer (PNDM/DDIM) and continuous (Euler/DPM) timesteps can be concatenated
+                    timesteps.append(t.reshape(1).to(torch.float32).expand(2))
+
+                with service.token_merging.use(group[0].tome_ratio), service.memory_policy.use(plan):
+                    noise_pred = pipe.unet(
+                        torch.cat(model_inputs),
+                        torch.cat(timesteps),
+                        encoder_hidden_states=torch.cat([task.text_embeddings for task in group]),
+                        return_dict=False,
+                    )[0]
+
+                for i, task in enumerate(group):
+                    noise_uncond, noise_text = noise_pred[2 * i:2 * i + 2].chunk(2)
+                    guided = noise_uncond + task.guidance_scale * (noise_text - noise_uncond)
+                    t = task.timesteps[task.step_index]
+                    task.latents = task.scheduler.step(guided, t, task.latents, return_dict=False,
+                                                       **step_kwargs(task.scheduler, task.generator))[0]
+                    task.step_index += 1
+                    task.notify_step(task.step_index, len(task.timesteps), task.latents)
+        except Exception as e:
+            traceback.print_exc()
+            for task in group:
+                task.finish(None, f"Generation error: {e}")
+
+    def _decode(self, tasks):
+        """Decode finished latents to PIL images, batched per resolution and decoder"""
+        import torch
+        groups = {}
+        for task in tasks:
+            groups.setdefault((task.latent_shape(), task.quality), []).append(task)
+
+        for (_, quality), group in groups.items():
+            try:
+                images = self.service.decode_latents(torch.cat([task.latents for task in group]), quality)
+                for task, image in zip(group, images):
+                    print(f"[ENGINE] Finished '{task.prompt}' in {time.time() - task.submitted_at:.1f}s")
+                    task.finish(image, latents=task.latents)
+            except Exception as e:
+                traceback.print_exc()
+                for task in group:
+                    task.finish(None, f"Generation error: {e}")
+
+        gc.collect()
+        if self.service.device == "cuda":
+            torch.cuda.empty_cache()
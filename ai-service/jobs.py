@@ -0,0 +1,132 @@
+"""Bounded in-memory store for asynchronous generation jobs"""
+
+import base64
+import io
+import threading
+import time
+import uuid
+
+
+class Job:
+    """One asynchronous /jobs request and the dispatcher request backing it"""
+
+    def __init__(self, params, request):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.request = request
+        self.created_at = time.time()
+        self.timing_recorded = False
+        self.latent_handle = None
+        self._image_b64 = None
+
+    def status(self):
+        if self.request.image is not None:
+            return "completed"
+        if self.request.is_cancelled():
+            return "cancelled"
+        if self.request.done.is_set():
+            return "failed"
+        if self.request.suspended:
+            return "suspended"
+        if self.request.started_at is not None:
+            return "running"
+        return "queued"
+
+    def is_finished(self):
+        return self.request.done.is_set()
+
+    def image_b64(self):
+        """PNG/base64 encoding is done on first read so the dispatcher thread never pays for it"""
+        if self._image_b64 is None and self.request.image is not None:
+            buffer = io.BytesIO()
+            self.request.image.save(buffer, format='PNG')
+            self._image_b64 = base64.b64encode(buffer.getvalue()).decode()
+        return self._image_b64
+
+
+class JobStore:
+    """Keeps jobs until their results expire, evicting the oldest finished ones when full"""
+
+    def __init__(self, dispatcher, enqueue, max_jobs=256, result_ttl=600):
+        self.dispatcher = dispatcher
+        self.enqueue = enqueue
+        self.max_jobs = max_jobs
+        self.result_ttl = result_ttl
+        self.jobs = {}
+        self.lock = threading.Lock()
+        # Exponential moving average of seconds per denoising step, seeded with a CPU-ish guess
+        self.seconds_per_step = 2.0
+
+    def create(self, params):
+        """Enqueue a generation and return its job, or None when the store is full of unfinished jobs"""
+        with self.lock:
+            self._expire()
+            if len(self.jobs) >= self.max_jobs and not self._evict_oldest_finished():
+                return None
+            request = self.enqueue(params)
+            job = Job(params, request)
+            self.jobs[job.id] = job
+            return job
+
+    def get(self, job_id):
+        with self.lock:
+            self._expire()
+            job = self.jobs.get(job_id)
+        if job and job.is_finished() and not job.timing_recorded:
+            self._record_completion(job)
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a job's generation; the job stays readable until its result expires"""
+        job = self.get(job_id)
+        if job is not None and not job.is_finished():
+            self.dispatcher.cancel(job.request)
+        return job
+
+    def queue_position(self, job):
+        if job.status() != "queued":
+            return 0
+        return self.dispatcher.queue_position(job.request)
+
+    def eta_seconds(self, job):
+        """Rough time until the result is ready, based on observed seconds per step"""
+        request = job.request
+        if request.done.is_set():
+            return 0.0
+        if request.started_at is not None:
+            progress = request.progress()
+            elapsed = time.time() - request.started_at
+            if progress > 0:
+                return round(elapsed / progress * (1.0 - progress), 1)
+            return round(max(0.0, request.steps * self.seconds_per_step - elapsed), 1)
+
+        with self.lock:
+            ahead = [j for j in self.jobs.values()
+                     if j.status() in ("queued", "running")
+                     and j.request.queue_order() < job.request.queue_order()]
+        steps_ahead = sum(j.params["steps"] for j in ahead)
+        return round((steps_ahead + request.steps) * self.seconds_per_step, 1)
+
+    def _record_completion(self, job):
+        """Feed a finished job's timing into the seconds-per-step estimate"""
+        job.timing_recorded = True
+        request = job.request
+        if request.started_at is None or request.finished_at is None or request.image is None:
+            return
+        observed = (request.finished_at - request.started_at) / max(1, request.steps)
+        self.seconds_per_step = 0.8 * self.seconds_per_step + 0.2 * observed
+
+    def _expire(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.is_finished() and now - job.request.finished_at > self.result_ttl]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def _evict_oldest_finished(self):
+        finished = [job for job in self.jobs.values() if job.is_finished()]
+        if not finished:
+            return False
+        oldest = min(finished, key=lambda job: job.request.finished_at)
+        del self.jobs[oldest.id]
+        return True
@@ -0,0 +1,65 @@
+"""Cache of VAE-encoded init images so repeated img2img edits of one source skip the resize and encoder"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def image_digest(image):
+    """Content hash of a PIL image's pixels, independent of where it was loaded from"""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class InitLatentCache:
+    """Scaled init latents keyed by image content hash and target resolution"""
+
+    def __init__(self, max_items=32):
+        self.max_items = max_items
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_or_encode(self, pipeline, image, width, height, tiler=None):
+        """Return latents for image at width x height, encoding with the pipeline's VAE on a miss
+
+        With a tiler (vae_tiling.VaeTiler), large images are encoded in overlapping tiles.
+        """
+        key = (image_digest(image), width, height)
+        with self.lock:
+            latents = self.entries.get(key)
+            if latents is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return latents
+            self.misses += 1
+
+        latents = self._encode(pipeline, image.convert("RGB").resize((width, height)), tiler)
+        with self.lock:
+            self.entries[key] = latents
+            while len(self.entries) > self.max_items:
+                self.entries.popitem(last=False)
+        return latents
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "items": len(self.entries)}
+
+    def _encode(self, pipeline, image, tiler=None):
+        import torch
+        vae = pipeline.vae
+        with torch.no_grad():
+            pixels = pipeline.image_processor.preprocess(image).to(device=vae.device, dtype=vae.dtype)
+            # The distribution mode keeps cached latents deterministic; img2img adds its own noise on top
+            if tiler is not None:
+                latents = tiler.encode(vae, pixels)
+            else:
+                latents = vae.encode(pixels).latent_dist.mode()
+        return latents * vae.config.scaling_factor
@@ -0,0 +1,50 @@
+"""Short-lived server-side handles to final latents, so chained generations skip decode/encode round trips"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class LatentStore:
+    """Bounded, expiring map from opaque handle to latents plus the metadata needed to reuse them"""
+
+    def __init__(self, max_items=64, ttl=300):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, latents, **meta):
+        """Keep latents (detached) and return a handle for follow-up requests"""
+        handle = uuid.uuid4().hex
+        with self.lock:
+            self._expire()
+            self.entries[handle] = (time.time(), latents.detach(), meta)
+            while len(self.entries) > self.max_items:
+                self.entries.popitem(last=False)
+        return handle
+
+    def get(self, handle):
+        """Return (latents, meta) for a live handle, or None if unknown or expired"""
+        with self.lock:
+            self._expire()
+            entry = self.entries.get(handle)
+            if entry is None:
+                return None
+            _, latents, meta = entry
+            return latents, meta
+
+    def stats(self):
+        with self.lock:
+            self._expire()
+            return {"items": len(self.entries), "max_items": self.max_items, "ttl_s": self.ttl}
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        # Entries are in insertion order, so expired ones are at the front
+        while self.entries:
+            created_at = next(iter(self.entries.values()))[0]
+            if created_at >= cutoff:
+                break
+            self.entries.popitem(last=False)
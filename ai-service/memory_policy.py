@@ -0,0 +1,160 @@
+"""Resolution-aware attention and VAE memory policy
+
+Instead of shrinking large requests when memory is short, each UNet call and VAE decode
+gets a plan: SDPA or sliced attention, and a full, per-image (sliced) or tiled VAE pass.
+The plan is picked from rough working-set estimates for the request's resolution and
+batch size against the memory available at that moment; images above a pixel threshold
+always use the tiled VAE.
+
+The UNet's attention processors are replaced once by one that reads the calling thread's
+plan, so concurrent callers (the batching thread, img2img request threads) can run with
+different plans on the same shared model.
+"""
+
+import threading
+from contextlib import contextmanager
+
+ATTENTION_MODES = ("auto", "sdpa", "sliced")
+VAE_MODES = ("auto", "full", "sliced", "tiled")
+
+# Attention heads at the highest-resolution UNet level (SD 1.x)
+UNET_HEADS = 8
+# Rough UNet activation peak for one 512x512 (64x64 latent) CFG pair in float32, excluding attention scores
+UNET_ACTIVATION_GB_512 = 0.6
+UNET_TOKENS_512 = 64 * 64
+# Rough VAE decoder activation peak for one 512x512 image in float32, excluding attention scores
+VAE_DECODE_GB_512 = 1.2
+
+
+class MemoryPlan:
+    """How one UNet call or VAE decode should run"""
+
+    def __init__(self, attention="sdpa", slice_size=None, vae_slicing=False, vae_tiling=False):
+        self.attention = attention
+        self.slice_size = slice_size
+        self.vae_slicing = vae_slicing
+        self.vae_tiling = vae_tiling
+
+    def describe(self):
+        attention = f"sliced({self.slice_size})" if self.attention == "sliced" else self.attention
+        vae = "tiled" if self.vae_tiling else "sliced" if self.vae_slicing else "full"
+        return f"attention={attention}, vae={vae}"
+
+
+class PolicyAttnProcessor:
+    """Attention processor running SDPA or sliced attention according to the calling thread's plan"""
+
+    def __init__(self, local):
+        from diffusers.models.attention_processor import AttnProcessor2_0
+        self.local = local
+        self.sdpa = AttnProcessor2_0()
+        self.sliced = {}
+
+    def __call__(self, attn, hidden_states, encoder_hidden_states=None, attention_mask=None, temb=None, **kwargs):
+        slice_size = getattr(self.local, "slice_size", None)
+        if not slice_size:
+            return self.sdpa(attn, hidden_states, encoder_hidden_states, attention_mask, temb, **kwargs)
+        processor = self.sliced.get(slice_size)
+        if processor is None:
+            from diffusers.models.attention_processor import SlicedAttnProcessor
+            processor = self.sliced.setdefault(slice_size, SlicedAttnProcessor(slice_size))
+        return processor(attn, hidden_states, encoder_hidden_states, attention_mask)
+
+
+class MemoryPolicy:
+    """Picks a MemoryPlan per request from its resolution, batch size and the memory available"""
+
+    def __init__(self, available_memory, attention_mode="auto", vae_mode="auto", tile_threshold_px=768 * 768,
+                 headroom=0.8):
+        self.available_memory = available_memory
+        self.tile_threshold_px = tile_threshold_px
+        self.attention_mode = attention_mode if attention_mode in ATTENTION_MODES else "auto"
+        self.vae_mode = vae_mode if vae_mode in VAE_MODES else "auto"
+        self.headroom = headroom
+        self.local = threading.local()
+        self.device = "cpu"
+        self.bytes_per_element = 4
+        # Image pixels per latent pixel along each side; 8 for SD 1.x, set from the loaded pipeline
+        self.vae_scale_factor = 8
+        self.controls_attention = False
+        self.plans = {}
+
+    def bind(self, pipeline, device):
+        """Install the thread-aware attention processor on a freshly loaded pipeline"""
+        import torch
+        self.device = device
+        self.bytes_per_element = 2 if pipeline.unet.dtype == torch.float16 else 4
+        self.vae_scale_factor = pipeline.vae_scale_factor
+        # The ONNX Runtime UNet stand-in has no attention processors
+        self.controls_attention = hasattr(pipeline.unet, "set_attn_processor")
+        if self.controls_attention:
+            pipeline.unet.set_attn_processor(PolicyAttnProcessor(self.local))
+        print(f"[MEMORY] Attention policy: {self.attention_mode}"
+              f"{'' if self.controls_attention else ' (not controllable on this backend)'}, VAE policy: {self.vae_mode}")
+
+    def _sdpa_is_memory_efficient(self):
+        # Flash/memory-efficient SDPA kernels exist for CUDA and CPU; elsewhere SDPA materializes the scores
+        return self.device in ("cuda", "cpu")
+
+    def _attention_scores_gb(self, tokens, rows):
+        return rows * tokens * tokens * self.bytes_per_element / 1024**3
+
+    def plan(self, width, height, batch=1):
+        """Choose attention and VAE strategies for batch images of width x height"""
+        budget = self.available_memory() * self.headroom
+        precision = self.bytes_per_element / 4
+        # The UNet and the VAE mid-block work on latent pixels, the VAE decoder's upsampling stages on image pixels
+        tokens = (width // self.vae_scale_factor) * (height // self.vae_scale_factor)
+        scale = (width * height) / (512 * 512) * precision
+        naive_attention = not self._sdpa_is_memory_efficient()
+
+        plan = MemoryPlan()
+        if self.controls_attention:
+            # Classifier-free guidance doubles the UNet batch
+            rows = 2 * batch * UNET_HEADS
+            activations = UNET_ACTIVATION_GB_512 * batch * tokens / UNET_TOKENS_512 * precision
+            scores = self._attention_scores_gb(tokens, rows) if naive_attention else 0.0
+            if self.attention_mode == "sliced" or (self.attention_mode == "auto" and activations + scores > budget):
+                # Largest slice (in batch x head rows) whose score matrix still fits next to the activations
+                per_row = self._attention_scores_gb(tokens, 1)
+                fit = int(max(budget - activations, 0) / per_row) if per_row else rows
+                plan.attention = "sliced"
+                plan.slice_size = max(1, min(rows, fit))
+
+        per_image = VAE_DECODE_GB_512 * scale
+        if naive_attention:
+            # The VAE mid-block attends over all latent pixels with a single head
+            per_image += self._attention_scores_gb(tokens, 1)
+        if self.vae_mode == "tiled" or (
+            self.vae_mode == "auto" and (per_image > budget or width * height > self.tile_threshold_px)
+        ):
+            plan.vae_tiling = True
+            plan.vae_slicing = True
+        elif self.vae_mode == "sliced" or (self.vae_mode == "auto" and per_image * batch > budget):
+            plan.vae_slicing = True
+
+        description = plan.describe()
+        key = (width, height, batch)
+        if self.plans.get(key) != description:
+            # Only log when the choice for this shape changes
+            self.plans[key] = description
+            print(f"[MEMORY] {batch}x {width}x{height}: {description} (budget {budget:.1f}GB)")
+        return plan
+
+    @contextmanager
+    def use(self, plan):
+        """Run the attention calls made by this thread inside the block according to plan"""
+        previous = getattr(self.local, "slice_size", None)
+        self.local.slice_size = plan.slice_size if plan.attention == "sliced" else None
+        try:
+            yield
+        finally:
+            self.local.slice_size = previous
+
+    def stats(self):
+        return {
+            "attention_mode": self.attention_mode,
+            "vae_mode": self.vae_mode,
+            "attention_controllable": self.controls_attention,
+            "plans": {f"{b}x{w}x{h}": description for (w, h, b), description in self.plans.items()},
+        }
@@ -0,0 +1,151 @@
+"""Offline model registry: model ids resolved to local snapshot directories before anything is loaded
+
+The registry file lists models in order of preference. Each entry names a model id and,
+optionally, a local directory holding its diffusers snapshot, plus the dtype, weight format
+and variant to load it with. Entries without a path are looked up in the local Hugging Face
+cache. Resolution and file validation only touch the filesystem, so a missing or incomplete
+model is reported up front instead of costing a Hub timeout per candidate.
+"""
+
+import json
+import os
+
+DTYPES = ("auto", "float16", "bfloat16", "float32")
+# Components the service loads weights for; the safety checker is always skipped
+WEIGHT_COMPONENTS = ("unet", "vae", "text_encoder")
+REQUIRED_FILES = (
+    "model_index.json",
+    "scheduler/scheduler_config.json",
+    "tokenizer/vocab.json",
+    "tokenizer/merges.txt",
+    "unet/config.json",
+    "vae/config.json",
+    "text_encoder/config.json",
+)
+
+
+class ModelUnavailable(Exception):
+    """No registry entry resolved to a complete local snapshot"""
+
+
+def _is_weight_file(name, safetensors, variant):
+    """Whether name is a weight file (or shard index) in the requested format and variant"""
+    extension = ".safetensors" if safetensors else ".bin"
+    for suffix in (extension, extension + ".index.json"):
+        if name.endswith(suffix):
+            stem = name[:-len(suffix)]
+            break
+    else:
+        return False
+    # model.fp16.safetensors, or model.fp16-00001-of-00002.safetensors when sharded
+    if variant is not None:
+        return stem.endswith("." + variant) or f".{variant}-" in stem
+    return "." not in stem
+
+
+class ModelEntry:
+    """One registry entry: where a model lives and how to load it"""
+
+    def __init__(self, model_id, path=None, dtype="auto", safetensors=True, variant=None):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown dtype '{dtype}' for {model_id}, expected one of {', '.join(DTYPES)}")
+        self.model_id = model_id
+        self.path = path
+        self.dtype = dtype
+        self.safetensors = safetensors
+        self.variant = variant
+
+    def dtype_name(self, device):
+        """torch dtype name to load with on device; half precision is only used on accelerators"""
+        if self.dtype == "auto":
+            return "float16" if device == "cuda" else "float32"
+        if self.dtype != "float32" and device == "cpu":
+            return "float32"
+        return self.dtype
+
+    def problems(self, folder):
+        """Missing or unusable files in a snapshot directory, empty when it can be loaded"""
+        problems = [name for name in REQUIRED_FILES if not os.path.isfile(os.path.join(folder, name))]
+        for component in WEIGHT_COMPONENTS:
+            component_dir = os.path.join(folder, component)
+            names = os.listdir(component_dir) if os.path.isdir(component_dir) else []
+            # isfile follows the HF cache's blob symlinks, so broken links count as missing
+            weights = [name for name in names if _is_weight_file(name, self.safetensors, self.variant)
+                       and os.path.isfile(os.path.join(component_dir, name))
+                       and os.path.getsize(os.path.join(component_dir, name)) > 0]
+            if not weights:
+                kind = "safetensors" if self.safetensors else ".bin"
+                problems.append(f"{component}/ has no {kind} weights" + (f" for variant {self.variant}" if self.variant else ""))
+        return problems
+
+
+class ModelRegistry:
+    """Ordered model entries, resolved against local files only"""
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    @classmethod
+    def load(cls, path):
+        """Read a JSON list of {id[, path, dtype, safetensors, variant]} objects; relative paths are relative to the file"""
+        base = os.path.dirname(os.path.abspath(path))
+        with open(path) as f:
+            entries = [
+                ModelEntry(
+                    entry["id"],
+                    path=os.path.join(base, os.path.expanduser(entry["path"])) if entry.get("path") else None,
+                    dtype=entry.get("dtype", "auto"),
+                    safetensors=entry.get("safetensors", True),
+                    variant=entry.get("variant"),
+                )
+                for entry in json.load(f)
+            ]
+        return cls(entries)
+
+    def model_ids(self):
+        return [entry.model_id for entry in self.entries]
+
+    def locate(self, entry):
+        """The entry's snapshot directory on this machine, or None; never contacts the Hub"""
+        if entry.path is not None:
+            return entry.path if os.path.isdir(entry.path) else None
+        try:
+            from huggingface_hub import snapshot_download
+            return snapshot_download(entry.model_id, local_files_only=True)
+        except Exception:
+            return None
+
+    def resolve(self, model_id=None, prepared=None):
+        """First entry (or the one named model_id) with a complete local snapshot, as (entry, folder)
+        
+        prepared(entry) may return a ready-made folder for an entry, which is then used instead of its source.
+        """
+        candidates = [entry for entry in self.entries if model_id is None or entry.model_id == model_id]
+        if not candidates:
+            raise ModelUnavailable(f"Model '{model_id}' is not in the registry ({', '.join(self.model_ids())})")
+        errors = []
+        for entry in candidates:
+            folder = prepared(entry) if prepared is not None else None
+            if folder is not None:
+                return entry, folder
+            folder = self.locate(entry)
+            if folder is None:
+                errors.append(f"{entry.model_id}: not found in {entry.path or 'the local Hugging Face cache'}")
+                continue
+            problems = entry.problems(folder)
+            if problems:
+                errors.append(f"{entry.model_id}: {folder} is incomplete ({'; '.join(problems)})")
+                continue
+            return entry, folder
+        raise ModelUnavailable("No complete local model snapshot:\n  " + "\n  ".join(errors))
+
+    def download(self, model_id=None):
+        """Fetch the first hub entry (or model_id) into the local cache, only the files the service loads"""
+        from diffusers import StableDiffusionPipeline
+        for entry in self.entries:
+            if entry.path is None and (model_id is None or entry.model_id == model_id):
+                print(f"Downloading model {entry.model_id}...")
+                StableDiffusionPipeline.download(entry.model_id, use_safetensors=entry.safetensors,
+                                                 variant=entry.variant, safety_checker=None)
+                return entry.model_id
+        raise ModelUnavailable("No registry entry can be downloaded from the Hub")
@@ -0,0 +1,221 @@
+"""ONNX Runtime backend: exported text encoder, UNet and VAE graphs standing in for the diffusers models
+
+The graphs are exported once per model into a cache directory. The stand-in modules keep
+the original model configs and call signatures, so the diffusers pipelines, the continuous
+batching engine and the caches run unchanged on top of them.
+"""
+
+import os
+import shutil
+
+import torch
+
+# Graph name -> input names; dynamic axes cover batch and latent/image size
+ONNX_GRAPHS = {
+    "text_encoder": ["input_ids"],
+    "unet": ["sample", "timestep", "encoder_hidden_states"],
+    "vae_encoder": ["sample"],
+    "vae_decoder": ["latent_sample"],
+}
+
+
+class _TextEncoderExport(torch.nn.Module):
+    def __init__(self, text_encoder):
+        super().__init__()
+        self.text_encoder = text_encoder
+
+    def forward(self, input_ids):
+        outputs = self.text_encoder(input_ids, return_dict=False)
+        return outputs[0], outputs[1]
+
+
+class _UNetExport(torch.nn.Module):
+    def __init__(self, unet):
+        super().__init__()
+        self.unet = unet
+
+    def forward(self, sample, timestep, encoder_hidden_states):
+        return self.unet(sample, timestep, encoder_hidden_states=encoder_hidden_states, return_dict=False)[0]
+
+
+class _VaeEncoderExport(torch.nn.Module):
+    def __init__(self, vae):
+        super().__init__()
+        self.vae = vae
+
+    def forward(self, sample):
+        # Mean and log-variance moments; the distribution itself is rebuilt around the session output
+        return self.vae.encode(sample, return_dict=False)[0].parameters
+
+
+class _VaeDecoderExport(torch.nn.Module):
+    def __init__(self, vae):
+        super().__init__()
+        self.vae = vae
+
+    def forward(self, latent_sample):
+        return self.vae.decode(latent_sample, return_dict=False)[0]
+
+
+def graph_path(cache_dir, name):
+    return os.path.join(cache_dir, name, "model.onnx")
+
+
+def export_onnx_models(pipeline, cache_dir, opset=17):
+    """Export the pipeline's models to cache_dir, skipping graphs that are already there"""
+    tokenizer = pipeline.tokenizer
+    unet_config = pipeline.unet.config
+    latent_size = unet_config.sample_size
+    image_size = latent_size * pipeline.vae_scale_factor
+    latent_channels = pipeline.vae.config.latent_channels
+
+    exports = {
+        "text_encoder": (
+            _TextEncoderExport(pipeline.text_encoder),
+            (torch.zeros(1, tokenizer.model_max_length, dtype=torch.int64),),
+            ["last_hidden_state", "pooler_output"],
+            {"input_ids": {0: "batch"}, "last_hidden_state": {0: "batch"}, "pooler_output": {0: "batch"}},
+        ),
+        "unet": (
+            _UNetExport(pipeline.unet),
+            (
+                torch.randn(2, unet_config.in_channels, latent_size, latent_size),
+                torch.ones(2, dtype=torch.float32),
+                torch.randn(2, tokenizer.model_max_length, unet_config.cross_attention_dim),
+            ),
+            ["out_sample"],
+            {
+                "sample": {0: "batch", 2: "height", 3: "width"},
+                "timestep": {0: "batch"},
+                "encoder_hidden_states": {0: "batch"},
+                "out_sample": {0: "batch", 2: "height", 3: "width"},
+            },
+        ),
+        "vae_encoder": (
+            _VaeEncoderExport(pipeline.vae),
+            (torch.randn(1, 3, image_size, image_size),),
+            ["latent_parameters"],
+            {"sample": {0: "batch", 2: "height", 3: "width"}, "latent_parameters": {0: "batch", 2: "height", 3: "width"}},
+        ),
+        "vae_decoder": (
+            _VaeDecoderExport(pipeline.vae),
+            (torch.randn(1, latent_channels, latent_size, latent_size),),
+            ["sample"],
+            {"latent_sample": {0: "batch", 2: "height", 3: "width"}, "sample": {0: "batch", 2: "height", 3: "width"}},
+        ),
+    }
+
+    for name, (module, args, output_names, dynamic_axes) in exports.items():
+        path = graph_path(cache_dir, name)
+        if os.path.exists(path):
+            continue
+        print(f"[ORT] Exporting {name} to {path}...")
+        # Export into a scratch directory first so an interrupted export is never mistaken for a cached graph
+        scratch_dir = os.path.join(cache_dir, f"{name}.tmp")
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+        os.makedirs(scratch_dir)
+        with torch.no_grad():
+            torch.onnx.export(
+                module.eval(), args, os.path.join(scratch_dir, "model.onnx"),
+                input_names=ONNX_GRAPHS[name], output_names=output_names,
+                dynamic_axes=dynamic_axes, opset_version=opset, do_constant_folding=True,
+            )
+        os.replace(scratch_dir, os.path.dirname(path))
+
+
+def create_session_options(threads=0):
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads > 0:
+        options.intra_op_num_threads = threads
+    return options
+
+
+class OrtModel(torch.nn.Module):
+    """Parameterless stand-in for a diffusers model whose forward runs through ONNX Runtime sessions"""
+
+    def __init__(self, config, dtype):
+        super().__init__()
+        self.config = config
+        self.dtype = dtype
+        # Inputs are copied to host memory for ORT, so the pipeline keeps its tensors on the CPU
+        self.device = torch.device("cpu")
+
+    @staticmethod
+    def load_session(path, provider, options):
+        import onnxruntime as ort
+        providers = [provider] if provider == "CPUExecutionProvider" else [provider, "CPUExecutionProvider"]
+        return ort.InferenceSession(path, sess_options=options, providers=providers)
+
+    def run(self, session, **inputs):
+        feeds = {name: value.detach().to("cpu", torch.float32 if value.is_floating_point() else value.dtype).numpy()
+                 for name, value in inputs.items()}
+        return [torch.from_numpy(output) for output in session.run(None, feeds)]
+
+
+class OrtTextEncoder(OrtModel):
+    def __init__(self, cache_dir, config, provider, options):
+        super().__init__(config, torch.float32)
+        self.session = self.load_session(graph_path(cache_dir, "text_encoder"), provider, options)
+
+    def forward(self, input_ids, attention_mask=None, output_hidden_states=False, return_dict=False):
+        if output_hidden_states:
+            raise ValueError("clip_skip is not supported by the ONNX Runtime text encoder")
+        last_hidden_state, pooler_output = self.run(self.session, input_ids=input_ids.to(torch.int64))
+        return last_hidden_state, pooler_output
+
+
+class OrtUNet(OrtModel):
+    def __init__(self, cache_dir, config, provider, options):
+        super().__init__(config, torch.float32)
+        self.session = self.load_session(graph_path(cache_dir, "unet"), provider, options)
+
+    def forward(self, sample, timestep, encoder_hidden_states, timestep_cond=None, cross_attention_kwargs=None,
+                added_cond_kwargs=None, return_dict=True):
+        # The pipelines pass one scalar timestep, the batching engine one per sample
+        timestep = torch.as_tensor(timestep, dtype=torch.float32).reshape(-1).expand(sample.shape[0])
+        (noise_pred,) = self.run(self.session, sample=sample, timestep=timestep,
+                                 encoder_hidden_states=encoder_hidden_states)
+        noise_pred = noise_pred.to(sample.device, sample.dtype)
+        if not return_dict:
+            return (noise_pred,)
+        from diffusers.models.unets.unet_2d_condition import UNet2DConditionOutput
+        return UNet2DConditionOutput(sample=noise_pred)
+
+
+class OrtVae(OrtModel):
+    def __init__(self, cache_dir, config, provider, options):
+        super().__init__(config, torch.float32)
+        self.encoder_session = self.load_session(graph_path(cache_dir, "vae_encoder"), provider, options)
+        self.decoder_session = self.load_session(graph_path(cache_dir, "vae_decoder"), provider, options)
+
+    def encode(self, x, return_dict=True):
+        from diffusers.models.autoencoders.vae import DiagonalGaussianDistribution
+        from diffusers.models.modeling_outputs import AutoencoderKLOutput
+        (moments,) = self.run(self.encoder_session, sample=x)
+        latent_dist = DiagonalGaussianDistribution(moments.to(x.device))
+        if not return_dict:
+            return (latent_dist,)
+        return AutoencoderKLOutput(latent_dist=latent_dist)
+
+    def decode(self, z, return_dict=True, generator=None):
+        from diffusers.models.autoencoders.vae import DecoderOutput
+        (sample,) = self.run(self.decoder_session, latent_sample=z)
+        sample = sample.to(z.device, z.dtype)
+        if not return_dict:
+            return (sample,)
+        return DecoderOutput(sample=sample)
+
+
+def use_ort_backend(pipeline, cache_dir, provider, threads=0):
+    """Export (once) and swap the pipeline's text encoder, UNet and VAE for ONNX Runtime sessions"""
+    export_onnx_models(pipeline, cache_dir)
+    options = create_session_options(threads)
+    pipeline.register_modules(
+        text_encoder=OrtTextEncoder(cache_dir, pipeline.text_encoder.config, provider, options),
+        unet=OrtUNet(cache_dir, pipeline.unet.config, provider, options),
+        vae=OrtVae(cache_dir, pipeline.vae.config, provider, options),
+    )
+    print(f"[ORT] Text encoder, UNet and VAE running on {provider}")
+    return pipeline
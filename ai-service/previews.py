@@ -0,0 +1,35 @@
+"""Cheap RGB previews decoded straight from SD latents without running the VAE"""
+
+import base64
+import io
+
+from PIL import Image
+
+# Linear approximation of the SD 1.x VAE decoder: each latent channel's contribution to R, G, B
+LATENT_RGB_FACTORS = [
+    [0.298, 0.207, 0.208],
+    [0.187, 0.286, 0.173],
+    [-0.158, 0.189, 0.264],
+    [-0.184, -0.271, -0.473],
+]
+
+
+def latents_to_preview(latents, size=None):
+    """Project a single (4, h, w) or (1, 4, h, w) latent to a small PIL image"""
+    import torch
+    if latents.dim() == 4:
+        latents = latents[0]
+    factors = torch.tensor(LATENT_RGB_FACTORS, dtype=torch.float32, device=latents.device)
+    rgb = torch.einsum("chw,cr->hwr", latents.float(), factors)
+    rgb = ((rgb + 1.0) / 2.0).clamp(0.0, 1.0).mul(255).round().to(torch.uint8)
+    image = Image.fromarray(rgb.cpu().numpy())
+    if size:
+        image = image.resize(size, Image.NEAREST)
+    return image
+
+
+def preview_b64(latents, size=None):
+    """Latent preview encoded as base64 PNG, ready to ship to the client"""
+    buffer = io.BytesIO()
+    latents_to_preview(latents, size).save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode()
@@ -0,0 +1,58 @@
+"""Dynamic INT8 quantization of the UNet and text encoder for CPU inference, cached on disk
+
+torch's dynamic quantization swaps every nn.Linear (attention q/k/v/out projections,
+feed-forward and text encoder MLPs) for an int8-weight version that quantizes
+activations on the fly. Convolutions and norms stay float32.
+"""
+
+import json
+import os
+
+import torch
+
+QUANTIZED_COMPONENTS = ("unet", "text_encoder")
+
+
+def _cache_stamp():
+    # Whole modules are pickled, so the cache is only valid for the versions that wrote it
+    import diffusers
+    import transformers
+    return {"torch": torch.__version__, "diffusers": diffusers.__version__, "transformers": transformers.__version__}
+
+
+def quantize_int8(module):
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_quantized_components(cache_dir):
+    """Return {name: quantized module} from cache_dir, or {} when there is no usable cache"""
+    try:
+        with open(os.path.join(cache_dir, "stamp.json")) as f:
+            if json.load(f) != _cache_stamp():
+                print("[INT8] Quantized cache was written by other library versions, rebuilding")
+                return {}
+        return {
+            name: torch.load(os.path.join(cache_dir, f"{name}.pt"), map_location="cpu", weights_only=False).eval()
+            for name in QUANTIZED_COMPONENTS
+        }
+    except Exception as e:
+        print(f"[INT8] No usable quantized cache in {cache_dir}: {e}")
+        return {}
+
+
+def quantize_pipeline(pipeline, cache_dir):
+    """Quantize the pipeline's UNet and text encoder in place and cache the results"""
+    os.makedirs(cache_dir, exist_ok=True)
+    stamp_path = os.path.join(cache_dir, "stamp.json")
+    if os.path.exists(stamp_path):
+        os.remove(stamp_path)
+    components = {}
+    for name in QUANTIZED_COMPONENTS:
+        print(f"[INT8] Quantizing {name}...")
+        components[name] = quantize_int8(getattr(pipeline, name).eval())
+        torch.save(components[name], os.path.join(cache_dir, f"{name}.pt"))
+    # Written last, so a partial cache is never picked up
+    with open(stamp_path, "w") as f:
+        json.dump(_cache_stamp(), f)
+    pipeline.register_modules(**components)
+    return pipeline
@@ -0,0 +1,108 @@
+"""Content-addressed cache of generated images with an LRU memory tier and a size-bounded disk tier"""
+
+import hashlib
+import io
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+
+def canonical_prompt(prompt):
+    """Collapse whitespace and case; the CLIP tokenizer lowercases anyway, so these render identically"""
+    return " ".join(prompt.split()).lower()
+
+
+class ResultCache:
+    """Maps a deterministic generation key to its PNG result"""
+
+    def __init__(self, memory_items=128, disk_dir=None, disk_size_mb=512):
+        self.memory_items = memory_items
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk = None
+        # Disk writes (PNG encode + diskcache set) happen off the dispatcher thread
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sd-result-cache")
+
+        if disk_dir:
+            try:
+                import diskcache
+                self.disk = diskcache.Cache(disk_dir, size_limit=int(disk_size_mb * 1024 * 1024))
+                print(f"Result cache disk tier: {disk_dir} ({disk_size_mb}MB)")
+            except ImportError:
+                print("Warning: diskcache not installed, result cache is memory-only")
+
+    @staticmethod
+    def make_key(prompt, steps, width, height, seed, scheduler, model_id, tome_ratio=0.0, quality="full"):
+        fields = {
+            "prompt": canonical_prompt(prompt),
+            "steps": steps,
+            "width": width,
+            "height": height,
+            "seed": seed,
+            "scheduler": scheduler,
+            "model_id": model_id,
+        }
+        # Only present when not at their defaults, so keys of plain results stay what they were
+        if tome_ratio:
+            fields["tome_ratio"] = tome_ratio
+        if quality != "full":
+            fields["quality"] = quality
+        return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key):
+        """Return the cached PIL image for key, or None on a miss"""
+        with self.lock:
+            image = self.memory.get(key)
+            if image is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return image
+
+        png = self.disk.get(key) if self.disk is not None else None
+        if png is None:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        image = Image.open(io.BytesIO(png))
+        image.load()
+        with self.lock:
+            self.hits += 1
+            self._remember(key, image)
+        return image
+
+    def put(self, key, image):
+        with self.lock:
+            self._remember(key, image)
+        if self.disk is not None:
+            self.writer.submit(self._write_disk, key, image)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "memory_items": len(self.memory),
+                "disk_items": len(self.disk) if self.disk is not None else 0,
+            }
+
+    def _remember(self, key, image):
+        self.memory[key] = image
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def _write_disk(self, key, image):
+        try:
+            buffer = io.BytesIO()
+            image.save(buffer, format='PNG')
+            self.disk.set(key, buffer.getvalue())
+        except Exception as e:
+            print(f"Warning: failed to write result cache entry: {e}")
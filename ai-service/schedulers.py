@@ -0,0 +1,44 @@
+"""Registry of samplers selectable per request, all built from the checkpoint's shared scheduler config"""
+
+import inspect
+
+# name -> (diffusers scheduler class, config overrides)
+SCHEDULERS = {
+    "pndm": ("PNDMScheduler", {"skip_prk_steps": True}),
+    "ddim": ("DDIMScheduler", {}),
+    "dpmpp_2m": ("DPMSolverMultistepScheduler", {"algorithm_type": "dpmsolver++"}),
+    "dpmpp_2m_karras": ("DPMSolverMultistepScheduler", {"algorithm_type": "dpmsolver++", "use_karras_sigmas": True}),
+    "dpmpp_sde": ("DPMSolverMultistepScheduler", {"algorithm_type": "sde-dpmsolver++"}),
+    "euler": ("EulerDiscreteScheduler", {}),
+    "euler_a": ("EulerAncestralDiscreteScheduler", {}),
+    "unipc": ("UniPCMultistepScheduler", {}),
+    # Only gives good results with LCM-distilled weights or an LCM-LoRA loaded on the UNet
+    "lcm": ("LCMScheduler", {}),
+}
+
+# Keeps whatever scheduler the checkpoint ships with (PNDM for SD 1.5)
+DEFAULT_SCHEDULER = "default"
+
+
+def scheduler_names():
+    return [DEFAULT_SCHEDULER] + sorted(SCHEDULERS)
+
+
+def create_scheduler(name, base_scheduler):
+    """Instantiate a fresh scheduler called name from base_scheduler's config"""
+    if name in (None, DEFAULT_SCHEDULER):
+        return base_scheduler.__class__.from_config(base_scheduler.config)
+    if name not in SCHEDULERS:
+        raise ValueError(f"Unknown scheduler '{name}', expected one of {', '.join(scheduler_names())}")
+
+    import diffusers
+    class_name, overrides = SCHEDULERS[name]
+    return getattr(diffusers, class_name).from_config(base_scheduler.config, **overrides)
+
+
+def step_kwargs(scheduler, generator):
+    """Extra scheduler.step() arguments: the request's generator, for samplers that add noise every step"""
+    # Ancestral, SDE and LCM samplers would otherwise draw from the global RNG and break seeded reproducibility
+    if generator is not None and "generator" in inspect.signature(scheduler.step).parameters:
+        return {"generator": generator}
+    return {}
@@ -0,0 +1,116 @@
+"""Single-flight coalescing: identical in-flight generations share one dispatcher request"""
+
+import threading
+
+from batching import CANCELLED_ERROR, GenerationRequest
+
+
+class CoalescedRequest(GenerationRequest):
+    """One caller's view of a shared in-flight generation"""
+
+    def __init__(self, flight, key, leader, priority="normal", on_step=None):
+        super().__init__(leader.prompt, leader.steps, leader.width, leader.height,
+                         on_step=on_step, priority=priority, seed=leader.seed,
+                         scheduler=leader.scheduler_name, tome_ratio=leader.tome_ratio, quality=leader.quality)
+        self.flight = flight
+        self.key = key
+        self.leader = leader
+
+    def root(self):
+        return self.leader
+
+    def notify_step(self, step, total_steps, latents):
+        self.started_at = self.leader.started_at
+        self.suspended = self.leader.suspended
+        super().notify_step(step, total_steps, latents)
+
+    def cancel(self):
+        # Only this caller stops waiting; the shared run is cancelled once nobody is left
+        super().cancel()
+        self.finish(None, CANCELLED_ERROR)
+        self.flight.release(self)
+
+
+class SingleFlight:
+    """Attaches duplicate requests to the computation already running for the same key"""
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.flights = {}
+        # Re-entrant: add_done_callback runs _forget inline if the leader has already finished
+        self.lock = threading.RLock()
+        self.coalesced = 0
+
+    def attach(self, key, start, priority="normal", on_step=None):
+        """Join the in-flight generation for key, or call start() to begin one; returns this caller's request
+
+        The shared run is promoted to the most urgent priority among its waiters.
+        """
+        while True:
+            with self.lock:
+                flight = self.flights.get(key)
+                starting = flight is None
+                if starting:
+                    # Placeholder, so duplicates arriving while start() runs wait for this leader
+                    flight = {"leader": None, "started": threading.Event(), "handles": set()}
+                    self.flights[key] = flight
+            if not starting:
+                flight["started"].wait()
+                if flight["leader"] is not None:
+                    break
+                # Its start() failed; try again, possibly as the leader
+                continue
+            # Not under the lock: start() takes the dispatcher's condition, and threads holding
+            # that condition finish requests, which runs _forget and needs this lock
+            try:
+                leader = start()
+            except BaseException:
+                with self.lock:
+                    del self.flights[key]
+                flight["started"].set()
+                raise
+            flight["leader"] = leader
+            flight["started"].set()
+            leader.add_done_callback(lambda finished: self._forget(key, finished))
+            break
+
+        leader = flight["leader"]
+        with self.lock:
+            handle = CoalescedRequest(self, key, leader, priority=priority, on_step=on_step)
+            if not starting:
+                self.coalesced += 1
+                handle.cache_status = "coalesced"
+                print(f"[SINGLE-FLIGHT] '{leader.prompt}' joined in-flight generation "
+                      f"({len(flight['handles']) + 1} waiters)")
+            flight["handles"].add(handle)
+            urgent = min(flight["handles"], key=lambda h: h.priority_rank).priority
+        if urgent != leader.priority:
+            self.dispatcher.promote(leader, urgent)
+
+        leader.add_step_listener(handle.notify_step)
+        leader.add_done_callback(
+            lambda finished: handle.finish(finished.image, finished.error, latents=finished.latents)
+        )
+        return handle
+
+    def release(self, handle):
+        """Drop a cancelled waiter, cancelling the shared run when it was the last one"""
+        with self.lock:
+            flight = self.flights.get(handle.key)
+            if flight is None or flight["leader"] is not handle.leader:
+                return
+            flight["handles"].discard(handle)
+            if flight["handles"]:
+                return
+            del self.flights[handle.key]
+        self.dispatcher.cancel(handle.leader)
+
+    def stats(self):
+        with self.lock:
+            return {"in_flight": len(self.flights), "coalesced": self.coalesced}
+
+    def _forget(self, key, leader):
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None and flight["leader"] is leader:
+                del self.flights[key]
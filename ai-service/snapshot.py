@@ -0,0 +1,84 @@
+"""Prepared pipeline snapshots for fast cold start, cached on disk
+
+The first load of a model from its registry source writes the pipeline back out with
+save_pretrained: every component already in the dtype the service runs it in, and every
+weight file unsharded safetensors, which from_pretrained memory-maps. Later startups load
+the snapshot instead, skipping dtype conversion, variant selection and .bin unpickling.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+from model_registry import ModelEntry
+
+STAMP_FILE = "stamp.json"
+
+
+def source_fingerprint(folder):
+    """Digest of the path, size and mtime of every file in a model source folder"""
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = sorted(name for name in dirs if not name.startswith("."))
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            try:
+                # stat follows the HF cache's blob symlinks, so updated weights change the digest
+                info = os.stat(path)
+            except OSError:
+                continue
+            digest.update(f"{os.path.relpath(path, folder)}\0{info.st_size}\0{info.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def _snapshot_stamp(entry, dtype_name, source):
+    # Written by save_pretrained, so only valid for the source, dtype and versions that wrote it
+    import diffusers
+    import torch
+    import transformers
+    return {
+        "model_id": entry.model_id,
+        "variant": entry.variant,
+        # A Hub cache path includes the commit hash; the fingerprint catches weights replaced in place
+        "source": os.path.realpath(source),
+        "weights": source_fingerprint(source),
+        "dtype": dtype_name,
+        "torch": torch.__version__,
+        "diffusers": diffusers.__version__,
+        "transformers": transformers.__version__,
+    }
+
+
+def snapshot_problems(snapshot_dir, entry, dtype_name, source):
+    """Why the snapshot in snapshot_dir cannot be used for entry at dtype_name; empty when it can
+
+    source is the entry's registry folder the snapshot must have been written from, None when it is missing.
+    """
+    try:
+        with open(os.path.join(snapshot_dir, STAMP_FILE)) as f:
+            stamp = json.load(f)
+    except (OSError, ValueError):
+        return ["no snapshot"]
+    if source is None:
+        return ["model source is no longer available to check the snapshot against"]
+    current = _snapshot_stamp(entry, dtype_name, source)
+    changed = [key for key in current if stamp.get(key) != current[key]]
+    if changed:
+        return [f"stale, {', '.join(changed)} changed since it was written"]
+    return ModelEntry(entry.model_id).problems(snapshot_dir)
+
+
+def save_snapshot(pipeline, snapshot_dir, entry, dtype_name, source):
+    """Write the pipeline loaded from source to snapshot_dir as target-dtype safetensors"""
+    print(f"[SNAPSHOT] Writing {entry.model_id} ({dtype_name}) to {snapshot_dir}...")
+    staging_dir = snapshot_dir + ".tmp"
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    # One file per component, so each loads with a single memory map
+    pipeline.save_pretrained(staging_dir, safe_serialization=True, max_shard_size="100GB")
+    # Written last, so a partial snapshot is never picked up
+    with open(os.path.join(staging_dir, STAMP_FILE), "w") as f:
+        json.dump(_snapshot_stamp(entry, dtype_name, source), f)
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+    os.replace(staging_dir, snapshot_dir)
+    print("[SNAPSHOT] Snapshot written")
@@ -0,0 +1,118 @@
+"""Idle-time pre-generation of sprites for a known prompt vocabulary"""
+
+import json
+import random
+import threading
+from collections import deque
+
+from result_cache import canonical_prompt
+
+
+class SpritePool:
+    """Keeps a few seeded, pre-rendered images per registered prompt and refills them when the service is idle"""
+
+    def __init__(self, service, dispatcher, size_per_prompt=3, poll_interval=1.0):
+        self.service = service
+        self.dispatcher = dispatcher
+        self.size_per_prompt = size_per_prompt
+        self.poll_interval = poll_interval
+        self.templates = {}
+        self.pools = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.served = 0
+        self.produced = 0
+        self.worker = None
+
+    @staticmethod
+    def pool_key(prompt, steps, width, height, scheduler, tome_ratio):
+        return (canonical_prompt(prompt), steps, width, height, scheduler, tome_ratio)
+
+    def register(self, prompt, steps, width, height, scheduler, tome_ratio):
+        """Add a prompt template to keep pre-rendered"""
+        key = self.pool_key(prompt, steps, width, height, scheduler, tome_ratio)
+        with self.lock:
+            if key not in self.templates:
+                self.templates[key] = {"prompt": prompt, "steps": steps, "width": width, "height": height,
+                                       "scheduler": scheduler, "tome_ratio": tome_ratio}
+                self.pools[key] = deque()
+                print(f"[POOL] Registered '{prompt}' ({steps} steps, {width}x{height})")
+        self._ensure_worker()
+        self.wakeup.set()
+
+    def load_config(self, path, default_scheduler, default_tome_ratio):
+        """Register every template listed in a JSON file of {prompt, steps, width, height[, scheduler, tome_ratio]} objects"""
+        with open(path) as f:
+            for entry in json.load(f):
+                self.register(entry["prompt"], entry.get("steps", 10), entry.get("width", 512), entry.get("height", 512),
+                              entry.get("scheduler", default_scheduler), entry.get("tome_ratio", default_tome_ratio))
+
+    def take(self, prompt, steps, width, height, scheduler, tome_ratio):
+        """Pop a ready (image, seed) for this template, or None when the pool is empty"""
+        key = self.pool_key(prompt, steps, width, height, scheduler, tome_ratio)
+        with self.lock:
+            pool = self.pools.get(key)
+            if not pool:
+                return None
+            image, seed = pool.popleft()
+            self.served += 1
+        # Refill right away if the service happens to be idle
+        self.wakeup.set()
+        return image, seed
+
+    def stats(self):
+        with self.lock:
+            return {
+                "templates": len(self.templates),
+                "ready": sum(len(pool) for pool in self.pools.values()),
+                "target_per_prompt": self.size_per_prompt,
+                "served": self.served,
+                "produced": self.produced,
+            }
+
+    def _ensure_worker(self):
+        if self.size_per_prompt <= 0:
+            return
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(target=self._run, name="sd-sprite-pool", daemon=True)
+            self.worker.start()
+
+    def _most_depleted(self):
+        with self.lock:
+            short = [(len(self.pools[key]), key) for key in self.templates
+                     if len(self.pools[key]) < self.size_per_prompt]
+        if not short:
+            return None
+        return min(short)[1]
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+
+            # Never trigger a model load, and only use compute nobody else is waiting for
+            if not self.service.model_loaded or not self.dispatcher.is_idle():
+                continue
+            key = self._most_depleted()
+            if key is None:
+                continue
+
+            template = self.templates[key]
+            seed = random.randrange(2**32)
+            # Bulk priority: on the continuous batching engine a real request arriving mid-refill suspends
+            # it at the next step until that request is done. The micro-batcher cannot interrupt a running
+            # pipeline call, so there at most this one render runs ahead of it; the idle check above keeps
+            # further refills from starting while requests are waiting
+            request = self.dispatcher.enqueue(
+                template["prompt"], template["steps"], template["width"], template["height"],
+                priority="bulk", seed=seed, scheduler=template["scheduler"], tome_ratio=template["tome_ratio"]
+            )
+            image, error = request.wait()
+            if image is None:
+                print(f"[POOL] Refill of '{template['prompt']}' failed: {error}")
+                continue
+            with self.lock:
+                self.pools[key].append((image, seed))
+                self.produced += 1
+            # Keep going while idle instead of waiting for the next poll
+            self.wakeup.set()
@@ -0,0 +1,63 @@
+"""Batched multi-strength img2img: several (strength, prompt) variations of one image in one denoising job
+
+With N steps, an img2img run at strength s only performs the last int(N * s) steps of
+the full schedule. Every variation therefore walks the same timestep sequence and
+simply joins it later the lower its strength is, so at each timestep all variations
+that have started can share one UNet call.
+"""
+
+import torch
+
+from schedulers import step_kwargs
+
+
+def run_strength_sweep(service, init_latents, prompt_embeds, negative_embeds, strengths, steps,
+                       guidance_scale=7.5, generator=None, scheduler=None):
+    """Denoise one shared init latent for every strength; returns the final latents in order"""
+    pipe = service.img2img_pipeline
+    count = len(strengths)
+
+    schedulers = []
+    starts = []
+    for strength in strengths:
+        # Same start-index arithmetic as StableDiffusionImg2ImgPipeline.get_timesteps
+        member_scheduler = service._new_scheduler(scheduler)
+        member_scheduler.set_timesteps(steps, device=service.device)
+        init_timestep = min(int(steps * strength), steps)
+        start = max(steps - init_timestep, 0) * member_scheduler.order
+        if hasattr(member_scheduler, "set_begin_index"):
+            member_scheduler.set_begin_index(start)
+        schedulers.append(member_scheduler)
+        starts.append(start)
+
+    noise = [
+        torch.randn(init_latents.shape, generator=generator, device=init_latents.device, dtype=init_latents.dtype)
+        for _ in range(count)
+    ]
+    latents = [None] * count
+
+    for index, t in enumerate(schedulers[0].timesteps):
+        active = [m for m in range(count) if starts[m] <= index]
+        if not active:
+            continue
+        for m in active:
+            if latents[m] is None:
+                # Joining now: noise the shared init latents to this variation's starting timestep
+                latents[m] = schedulers[m].add_noise(init_latents, noise[m], t.reshape(1))
+
+        model_input = torch.cat([
+            schedulers[m].scale_model_input(torch.cat([latents[m]] * 2), t) for m in active
+        ])
+        text_embeddings = torch.cat([
+            torch.cat([negative_embeds[m:m + 1], prompt_embeds[m:m + 1]]) for m in active
+        ])
+        noise_pred = pipe.unet(model_input, t, encoder_hidden_states=text_embeddings, return_dict=False)[0]
+
+        for j, m in enumerate(active):
+            noise_uncond, noise_text = noise_pred[2 * j:2 * j + 2].chunk(2)
+            guided = noise_uncond + guidance_scale * (noise_text - noise_uncond)
+            latents[m] = schedulers[m].step(guided, t, latents[m], return_dict=False,
+                                            **step_kwargs(schedulers[m], generator))[0]
+
+    # A strength too low to cover a single step leaves the source image untouched
+    return [l if l is not None else init_latents for l in latents]
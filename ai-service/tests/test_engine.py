@@ -0,0 +1,97 @@
+"""ContinuousBatchingEngine scheduling, run against a stand-in pipeline with deterministic arithmetic"""
+
+import contextlib
+import threading
+import types
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from engine import ContinuousBatchingEngine
+
+
+class FakeScheduler:
+    init_noise_sigma = 1.0
+    order = 1
+
+    def set_timesteps(self, steps, device=None):
+        self.timesteps = torch.arange(steps, 0, -1, device=device)
+
+    def scale_model_input(self, sample, t):
+        return sample
+
+    def step(self, noise_pred, t, sample, return_dict=False):
+        return (sample - 0.1 * noise_pred,)
+
+
+class FakeUNet:
+    config = types.SimpleNamespace(in_channels=4)
+
+    def __init__(self, step_delay):
+        self.step_delay = step_delay
+
+    def __call__(self, sample, timestep, encoder_hidden_states, return_dict=False):
+        # Element-wise per batch row, so the result does not depend on what else shares the batch
+        threading.Event().wait(self.step_delay)
+        text = encoder_hidden_states.mean(dim=(1, 2)).view(-1, 1, 1, 1)
+        return (0.5 * sample + 0.01 * timestep.view(-1, 1, 1, 1) + 0.001 * text,)
+
+
+class FakeService:
+    """Just enough of StableDiffusionService for the engine; step_delay keeps long tasks running"""
+
+    device = "cpu"
+    model_loaded = True
+
+    def __init__(self, step_delay=0.0):
+        self.pipeline = types.SimpleNamespace(unet=FakeUNet(step_delay), vae_scale_factor=8)
+        self.embedding_cache = types.SimpleNamespace(encode_batch=self._encode)
+        self.token_merging = types.SimpleNamespace(use=lambda ratio: contextlib.nullcontext())
+        self.memory_policy = types.SimpleNamespace(plan=lambda w, h, n: None,
+                                                   use=lambda plan: contextlib.nullcontext())
+
+    def load_model(self):
+        return True
+
+    def _check_memory(self):
+        return None, None
+
+    def _new_scheduler(self, name):
+        return FakeScheduler()
+
+    def _encode(self, prompts):
+        embeds = torch.full((len(prompts), 2, 4), float(len(prompts[0])))
+        return embeds, torch.zeros_like(embeds)
+
+    def decode_latents(self, latents, quality):
+        return [latents[i:i + 1].clone() for i in range(latents.shape[0])]
+
+
+def test_bulk_task_is_suspended_while_interactive_work_runs():
+    reference = ContinuousBatchingEngine(FakeService())
+    expected, error = reference.enqueue("background", 30, 64, 64, priority="bulk", seed=7).wait(30)
+    assert error is None
+
+    engine = ContinuousBatchingEngine(FakeService(step_delay=0.01))
+    started = threading.Event()
+    bulk = engine.enqueue("background", 30, 64, 64, priority="bulk", seed=7,
+                          on_step=lambda step, total, latents: step >= 3 and started.set())
+    assert started.wait(30)
+
+    # A different resolution, so it could never share the bulk task's UNet call
+    observed = []
+    interactive = engine.enqueue("player sprite", 4, 32, 32, priority="interactive", seed=1,
+                                 on_step=lambda step, total, latents: observed.append((bulk.suspended, bulk.step)))
+    image, error = interactive.wait(30)
+    assert image is not None and error is None
+    assert not bulk.done.is_set()
+
+    assert len(observed) == 4
+    assert all(suspended for suspended, _ in observed)
+    assert len({step for _, step in observed}) == 1
+
+    image, error = bulk.wait(30)
+    assert error is None
+    assert not bulk.suspended
+    assert torch.equal(image, expected)
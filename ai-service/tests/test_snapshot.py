@@ -0,0 +1,69 @@
+"""Snapshot stamps: a snapshot is only reused for the exact source it was written from"""
+
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("diffusers")
+pytest.importorskip("transformers")
+
+from model_registry import REQUIRED_FILES, ModelEntry
+from snapshot import save_snapshot, snapshot_problems
+
+WEIGHT_FILES = ("unet/diffusion_pytorch_model.safetensors", "vae/diffusion_pytorch_model.safetensors",
+                "text_encoder/model.safetensors")
+
+
+class CopyingPipeline:
+    """Stands in for a loaded pipeline: save_pretrained copies its source folder"""
+
+    def __init__(self, source):
+        self.source = source
+
+    def save_pretrained(self, directory, **kwargs):
+        shutil.copytree(self.source, directory)
+
+
+def make_source(folder, weights=b"weights"):
+    for name in REQUIRED_FILES + WEIGHT_FILES:
+        path = os.path.join(folder, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(weights if name in WEIGHT_FILES else b"{}")
+    return str(folder)
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    entry = ModelEntry("tiny/local", path=str(tmp_path / "weights"), dtype="float32")
+    source = make_source(tmp_path / "weights")
+    snapshot_dir = str(tmp_path / "snapshot")
+    save_snapshot(CopyingPipeline(source), snapshot_dir, entry, "float32", source)
+    return entry, source, snapshot_dir
+
+
+def test_snapshot_is_used_for_its_own_source(snapshot):
+    entry, source, snapshot_dir = snapshot
+    assert snapshot_problems(snapshot_dir, entry, "float32", source) == []
+
+
+def test_snapshot_is_stale_when_the_entry_points_at_another_folder(snapshot, tmp_path):
+    entry, _, snapshot_dir = snapshot
+    other = make_source(tmp_path / "other-weights")
+    problems = snapshot_problems(snapshot_dir, entry, "float32", other)
+    assert problems and "source" in problems[0]
+
+
+def test_snapshot_is_stale_when_weights_change_in_place(snapshot):
+    entry, source, snapshot_dir = snapshot
+    with open(os.path.join(source, WEIGHT_FILES[0]), "wb") as f:
+        f.write(b"retrained weights")
+    problems = snapshot_problems(snapshot_dir, entry, "float32", source)
+    assert problems and "weights" in problems[0]
+
+
+def test_snapshot_is_not_trusted_without_its_source(snapshot):
+    entry, _, snapshot_dir = snapshot
+    assert snapshot_problems(snapshot_dir, entry, "float32", None)
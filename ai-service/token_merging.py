@@ -0,0 +1,123 @@
+"""Runtime-switchable token merging (tomesd) on the shared UNet
+
+tomesd patches the UNet's transformer blocks in place, so merging can be applied and
+removed without reloading the model. Its per-call state lives in dicts shared by every
+patched block: the merge ratio, the latent size recorded by a UNet pre-hook and the
+generator for random token partitions. Those entries are swapped for thread-local ones,
+so the batching thread and img2img request threads can run the same patched UNet at the
+same time with different ratios and resolutions.
+"""
+
+import importlib.util
+import threading
+from contextlib import contextmanager
+
+# tomesd's limit for its default 2x2 destination stride: 1 - 1 / (sx * sy)
+MAX_RATIO = 0.75
+
+
+class _ThreadLocalDict(dict):
+    """One of tomesd's shared dicts, except that the keys in defaults are stored per calling thread"""
+
+    def __init__(self, values, local, defaults):
+        super().__init__(values)
+        self.local = local
+        self.defaults = defaults
+
+    def __getitem__(self, key):
+        if key in self.defaults:
+            return getattr(self.local, f"tome_{key}", self.defaults[key])
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        if key in self.defaults:
+            setattr(self.local, f"tome_{key}", value)
+        else:
+            super().__setitem__(key, value)
+
+
+class TokenMerging:
+    """Applies tomesd to a UNet on demand and scopes the merge ratio to the calling thread"""
+
+    def __init__(self, default_ratio=0.0, enabled=True):
+        # Known before the model loads, so request ratios resolve the same before and after
+        self.supported = enabled and self._tomesd_installed()
+        self.default_ratio = default_ratio if self.supported else 0.0
+        self.unet = None
+        self.patched = False
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def bind(self, unet):
+        """Attach to a freshly loaded UNet, patching it right away when a default ratio is set"""
+        with self.lock:
+            self._remove()
+            self.unet = unet
+            if self.supported and not any(type(m).__name__ == "BasicTransformerBlock" for m in unet.modules()):
+                print("[TOME] UNet has no transformer blocks, token merging disabled")
+                self.supported = False
+                self.default_ratio = 0.0
+            if self.default_ratio > 0:
+                self._apply()
+
+    def resolve(self, ratio):
+        """The ratio a request actually runs with: its own, or the server default"""
+        if not self.supported:
+            return 0.0
+        return self.default_ratio if ratio is None else ratio
+
+    def set_default(self, ratio):
+        """Change the server-wide ratio; 0 removes the patch from the UNet"""
+        with self.lock:
+            self.default_ratio = ratio if self.supported else 0.0
+            if self.default_ratio > 0:
+                self._apply()
+            else:
+                self._remove()
+
+    @contextmanager
+    def use(self, ratio):
+        """Run the UNet calls made by this thread inside the block with the given ratio"""
+        ratio = self.resolve(ratio)
+        if ratio > 0 and not self.patched:
+            with self.lock:
+                self._apply()
+        previous = getattr(self.local, "tome_ratio", 0.0)
+        self.local.tome_ratio = ratio
+        try:
+            yield
+        finally:
+            self.local.tome_ratio = previous
+
+    def stats(self):
+        return {"supported": self.supported, "patched": self.patched, "default_ratio": self.default_ratio}
+
+    @staticmethod
+    def _tomesd_installed():
+        # Checked without importing it, since tomesd imports torch
+        if importlib.util.find_spec("tomesd") is not None:
+            return True
+        print("[TOME] tomesd is not installed, token merging disabled")
+        return False
+
+    def _apply(self):
+        if self.patched or not self.supported or self.unet is None:
+            return
+        import tomesd
+        tomesd.apply_patch(self.unet, ratio=0.0)
+        info = _ThreadLocalDict(self.unet._tome_info, self.local, {"size": None})
+        info["args"] = _ThreadLocalDict(info["args"], self.local, {"ratio": 0.0, "generator": None})
+        # Every patched block holds a reference to the UNet's info dict, so all of them get the new one
+        for module in self.unet.modules():
+            if hasattr(module, "_tome_info"):
+                module._tome_info = info
+        self.patched = True
+        print("[TOME] Token merging patch applied")
+
+    def _remove(self):
+        if not self.patched:
+            return
+        import tomesd
+        tomesd.remove_patch(self.unet)
+        self.patched = False
+        print("[TOME] Token merging patch removed")
@@ -0,0 +1,77 @@
+"""Tiled VAE encode/decode with overlapping, feathered tiles
+
+Peak VAE memory grows with pixel count, so large images are split into fixed-size
+overlapping tiles that are encoded or decoded one at a time and blended back together.
+Peak memory then depends on the tile size, not the output size. Only vae.encode and
+vae.decode are called, so this works for the PyTorch VAE and the ONNX Runtime stand-in.
+"""
+
+
+def tile_starts(length, tile, stride):
+    """Tile offsets covering [0, length), the last one flush with the end"""
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile + 1, stride))
+    if starts[-1] + tile < length:
+        starts.append(length - tile)
+    return starts
+
+
+def feather_mask(height, width, overlap, device, dtype):
+    """Weights ramping up over overlap pixels from every edge; never zero, so every pixel is covered"""
+    import torch
+
+    def ramp(length):
+        positions = torch.arange(length, device=device, dtype=dtype)
+        distance = torch.minimum(positions, length - 1 - positions)
+        return ((distance + 1) / (overlap + 1)).clamp(max=1.0)
+    return ramp(height)[:, None] * ramp(width)[None, :]
+
+
+class VaeTiler:
+    """Encodes and decodes images larger than tile_size in overlapping tiles"""
+
+    def __init__(self, scale_factor=8, tile_size=512, overlap=64):
+        self.scale_factor = scale_factor
+        self.tile_size = tile_size
+        self.overlap = overlap
+
+    def decode(self, vae, latents):
+        """Decode unscaled latents (B, C, h, w) to images (B, 3, h * f, w * f) tile by tile"""
+        import torch
+        f = self.scale_factor
+        tile, overlap = self.tile_size // f, max(self.overlap // f, 1)
+        batch, _, height, width = latents.shape
+        output = None
+        weights = None
+        for y in tile_starts(height, tile, tile - overlap):
+            for x in tile_starts(width, tile, tile - overlap):
+                decoded = vae.decode(latents[:, :, y:y + tile, x:x + tile], return_dict=False)[0]
+                if output is None:
+                    output = torch.zeros(batch, decoded.shape[1], height * f, width * f,
+                                         device=decoded.device, dtype=decoded.dtype)
+                    weights = torch.zeros(height * f, width * f, device=decoded.device, dtype=decoded.dtype)
+                mask = feather_mask(decoded.shape[2], decoded.shape[3], overlap * f, decoded.device, decoded.dtype)
+                output[:, :, y * f:y * f + decoded.shape[2], x * f:x * f + decoded.shape[3]] += decoded * mask
+                weights[y * f:y * f + decoded.shape[2], x * f:x * f + decoded.shape[3]] += mask
+        return output / weights
+
+    def encode(self, vae, pixels):
+        """Encode images (B, 3, H, W) to unscaled latent means (B, C, H / f, W / f) tile by tile"""
+        import torch
+        f = self.scale_factor
+        tile, overlap = self.tile_size, max(self.overlap, f)
+        batch, _, height, width = pixels.shape
+        output = None
+        weights = None
+        for y in tile_starts(height, tile, tile - overlap):
+            for x in tile_starts(width, tile, tile - overlap):
+                encoded = vae.encode(pixels[:, :, y:y + tile, x:x + tile]).latent_dist.mode()
+                if output is None:
+                    output = torch.zeros(batch, encoded.shape[1], height // f, width // f,
+                                         device=encoded.device, dtype=encoded.dtype)
+                    weights = torch.zeros(height // f, width // f, device=encoded.device, dtype=encoded.dtype)
+                mask = feather_mask(encoded.shape[2], encoded.shape[3], overlap // f, encoded.device, encoded.dtype)
+                output[:, :, y // f:y // f + encoded.shape[2], x // f:x // f + encoded.shape[3]] += encoded * mask
+                weights[y // f:y // f + encoded.shape[2], x // f:x // f + encoded.shape[3]] += mask
+        return output / weights
@@ -0,0 +1,68 @@
+"""Background model load and warm-up at startup, so the first real request sees steady-state latency"""
+
+import threading
+import time
+
+
+def parse_buckets(spec):
+    """Parse "256x256,512x512" into [(256, 256), (512, 512)]"""
+    buckets = []
+    for item in spec.split(","):
+        item = item.strip()
+        if item:
+            width, height = item.lower().split("x")
+            buckets.append((int(width), int(height)))
+    return buckets
+
+
+class Warmup:
+    """Loads the model on a background thread, then runs one short generation per resolution bucket"""
+
+    def __init__(self, service, dispatcher, buckets, steps=2):
+        self.service = service
+        self.dispatcher = dispatcher
+        self.buckets = buckets
+        self.steps = steps
+        self.state = "pending"
+        self.error = None
+        self.timings = {}
+        self.ready = threading.Event()
+        self.worker = None
+
+    def start(self):
+        if self.worker is None:
+            self.worker = threading.Thread(target=self._run, name="sd-warmup", daemon=True)
+            self.worker.start()
+
+    def is_ready(self):
+        return self.ready.is_set()
+
+    def status(self):
+        return {"state": self.state, "error": self.error, "buckets": [f"{w}x{h}" for w, h in self.buckets],
+                "timings": self.timings}
+
+    def _run(self):
+        self.state = "loading"
+        start = time.time()
+        if not self.service.load_model():
+            self.state = "failed"
+            self.error = "Model failed to load"
+            return
+        self.timings["load"] = round(time.time() - start, 3)
+
+        self.state = "warming"
+        for width, height in self.buckets:
+            start = time.time()
+            # Bulk priority: on the continuous batching engine a real request arriving during warm-up
+            # suspends this render until it is done; the micro-batcher finishes the current render first
+            request = self.dispatcher.enqueue("warm-up", self.steps, width, height, priority="bulk", seed=0)
+            image, error = request.wait()
+            if image is None:
+                print(f"[WARMUP] {width}x{height} failed: {error}")
+                continue
+            self.timings[f"{width}x{height}"] = round(time.time() - start, 3)
+            print(f"[WARMUP] {width}x{height} warmed up in {self.timings[f'{width}x{height}']:.1f}s")
+
+        self.state = "ready"
+        self.ready.set()
+        print("[WARMUP] Service ready")
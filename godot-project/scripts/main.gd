@@ -18,9 +18,9 @@ func _ready():
 	print("[READY] AI Art Game Ready!")
 	print("Press SPACE to generate random art")
 	print("Use arrow keys to move player")
-	# Auto-generate test art for comparison
+	# Auto-generate test art for comparison once the service has loaded and warmed up
 	get_tree().create_timer(1.0).timeout.connect(test_server_connection)
-	get_tree().create_timer(3.0).timeout.connect(generate_test_art)
+	get_tree().create_timer(1.0).timeout.connect(wait_for_service)
 
 func _process(delta):
 	if test_mode:
@@ -84,6 +84,7 @@ func generate_trail_art():
 		"width": 512,
 		"height": 512,
 		"steps": 8,
+		"quality": "preview",  # Trail sprites are short-lived, a fast decode is enough
 	})
 	var headers = ["Content-Type: application/json"]
 	print("[TRAIL] Payload: ", json_data)
@@ -180,6 +181,23 @@ func _on_health_received(result: int, response_code: int, headers: PackedStringA
 	else:
 		print("[HEALTH FAILED] Result: ", result, " Code: ", response_code)
 
+func wait_for_service():
+	var ready_http = HTTPRequest.new()
+	add_child(ready_http)
+	ready_http.request_completed.connect(_on_ready_received.bind(ready_http))
+	ready_http.timeout = 10.0
+	ready_http.request("http://127.0.0.1:8080/ready")
+
+func _on_ready_received(result: int, response_code: int, headers: PackedStringArray, body: PackedByteArray, ready_http: HTTPRequest):
+	ready_http.queue_free()
+	if result == HTTPRequest.RESULT_SUCCESS and response_code == 200:
+		print("[SERVICE READY] Model loaded and warmed up")
+		generate_test_art()
+	else:
+		# 503 while the model loads and warms up, or the server is not up yet
+		print("[SERVICE WAITING] Result: ", result, " Code: ", response_code, " Body: ", body.get_string_from_utf8())
+		get_tree().create_timer(2.0).timeout.connect(wait_for_service)
+
 func create_trail_sprite(image_base64: String):
 	print("[IMAGE] Processing base64 image data (", image_base64.length(), " chars)...")
 	var image_data = Marshalls.base64_to_raw(image_base64)